@@ -0,0 +1,259 @@
+# Export pipeline benchmarks on synthetic meshes.
+#
+#   python benchmarks/bench_export.py                       # 1k to 1M vertices, every node group
+#   python benchmarks/bench_export.py --sizes 1000 100000 --groups CARPAINTMM
+#   python benchmarks/bench_export.py --save-baseline       # record this machine's numbers
+#
+# Everything after bpy extraction runs here without Blender: the synthetic mesh
+# has the same per-loop arrays extract_mesh_arrays returns. loop_tangents is the
+# NumPy fallback used for meshes calc_tangents cannot handle. Each stage is timed
+# on its own (best of --repeat runs), then the pipeline is run once more under
+# tracemalloc for the peak memory of every stage. Results are compared against
+# baseline.json; stages slower than the tolerance are reported as regressions.
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'io_export_rbm'))
+
+from rbm_format import MATERIAL_SCHEMAS, calculate_global_min_max, compress_normals, write_to_file
+from rbm_mesh import build_geometry, loop_tangents, split_into_blocks
+
+DEFAULT_SIZES = (1000, 10000, 100000, 1000000)
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+STAGES = ('loop_tangents', 'compress_normals', 'build_geometry', 'split_into_blocks', 'global_min_max', 'write_to_file')
+
+# Stages faster than this are too noisy to flag as regressions
+MIN_COMPARE_SECONDS = 0.002
+
+def synthetic_mesh(vertex_count, uv_layer_count=2):
+    # A rippled grid of quads triangulated like Blender's loop triangles. The first
+    # UV layer has a seam down the middle, so welding has vertices to split
+    side = max(2, int(math.ceil(math.sqrt(vertex_count))))
+    axis = np.linspace(-10.0, 10.0, side, dtype=np.float64)
+    x, y = np.meshgrid(axis, axis, indexing='xy')
+    z = 0.2 * np.sin(x) * np.cos(y)
+    dz_dx = 0.2 * np.cos(x) * np.cos(y)
+    dz_dy = -0.2 * np.sin(x) * np.sin(y)
+    positions = np.stack([x, y, z], axis=-1).reshape(-1, 3).astype(np.float32)
+
+    vertex_normals = np.stack([-dz_dx, -dz_dy, np.ones_like(z)], axis=-1).reshape(-1, 3)
+    vertex_normals /= np.linalg.norm(vertex_normals, axis=1, keepdims=True)
+    vertex_tangents = np.stack([np.ones_like(z), np.zeros_like(z), dz_dx], axis=-1).reshape(-1, 3)
+    vertex_tangents /= np.linalg.norm(vertex_tangents, axis=1, keepdims=True)
+
+    rows, columns = np.meshgrid(np.arange(side - 1), np.arange(side - 1), indexing='ij')
+    corner = (rows * side + columns).reshape(-1)
+    loop_vertex_indices = np.stack([corner, corner + 1, corner + side + 1, corner + side], axis=1).reshape(-1).astype(np.int32)
+
+    quad_loops = np.arange(len(corner), dtype=np.int32)[:, None] * 4
+    triangle_loops = np.concatenate([
+        quad_loops + np.array([0, 1, 2], dtype=np.int32),
+        quad_loops + np.array([0, 2, 3], dtype=np.int32),
+    ], axis=1).reshape(-1, 3)
+
+    grid_uv = np.stack([(x + 10.0) / 20.0, (y + 10.0) / 20.0], axis=-1).reshape(-1, 2)
+    uv_layers = []
+    for layer in range(uv_layer_count):
+        uv = grid_uv[loop_vertex_indices].astype(np.float32)
+        if layer == 0:
+            right_half = np.repeat(columns.reshape(-1) >= (side - 1) // 2, 4)
+            uv[right_half, 0] += 1.0
+        uv_layers.append(uv)
+
+    return {
+        'vertices': positions,
+        'loop_vertex_indices': loop_vertex_indices,
+        'triangle_loops': triangle_loops,
+        'uv_layers': uv_layers,
+        'normals': vertex_normals[loop_vertex_indices].astype(np.float32),
+        'tangents': vertex_tangents[loop_vertex_indices].astype(np.float32),
+        'bitangent_signs': np.ones(len(loop_vertex_indices), dtype=np.float32),
+    }
+
+def synthetic_material(node_group_name):
+    schema = MATERIAL_SCHEMAS[node_group_name]
+    texture_paths = []
+    for slot in schema['texture_slots']:
+        path = f"textures/benchmark/{slot.lower()}.ddsc"
+        texture_paths.append((len(path), path))
+    return {
+        'node_group_name': node_group_name,
+        'flags_value': 0,
+        'texture_paths': texture_paths,
+        'node_values': {},
+        'color_values': {},
+        'boolean_values': {},
+    }
+
+def array_bytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(array_bytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(array_bytes(item) for item in value)
+    return 0
+
+def run_pipeline(mesh_arrays, material, file_path, measure):
+    # measure(stage, bytes_in, fn) runs fn, records the stage and returns fn's result
+    measure('loop_tangents', array_bytes([mesh_arrays['vertices'], mesh_arrays['normals'], mesh_arrays['uv_layers'][0]]),
+            lambda: loop_tangents(mesh_arrays['vertices'], mesh_arrays['loop_vertex_indices'],
+                                  mesh_arrays['triangle_loops'], mesh_arrays['normals'], mesh_arrays['uv_layers'][0]))
+    measure('compress_normals', array_bytes([mesh_arrays['normals'], mesh_arrays['tangents'], mesh_arrays['bitangent_signs']]),
+            lambda: (compress_normals(mesh_arrays['normals']),
+                     compress_normals(mesh_arrays['tangents'], mesh_arrays['bitangent_signs'])))
+
+    geometry = measure('build_geometry', array_bytes(mesh_arrays), lambda: build_geometry(mesh_arrays))
+    obj_data = dict(geometry, face_indices_count=len(geometry['faces']) * 3, **material)
+
+    blocks = measure('split_into_blocks', array_bytes(geometry), lambda: split_into_blocks(obj_data))
+    min_max_positions = measure('global_min_max', array_bytes([block['vertices'] for block in blocks]),
+                                lambda: calculate_global_min_max(blocks))
+
+    # The written size is only known afterwards, so the byte count is filled in from the file
+    measure('write_to_file', None, lambda: write_to_file(file_path, blocks, min_max_positions))
+    return geometry['weld_stats']
+
+def benchmark_case(node_group_name, vertex_count, repeat, work_dir):
+    mesh_arrays = synthetic_mesh(vertex_count, uv_layer_count=3 if node_group_name == 'CARPAINTMM' else 2)
+    source_vertices = len(mesh_arrays['vertices'])
+    material = synthetic_material(node_group_name)
+    file_path = os.path.join(work_dir, f"{node_group_name}_{vertex_count}.rbm")
+
+    seconds = {stage: math.inf for stage in STAGES}
+    bytes_in = {}
+
+    def timed(stage, stage_bytes, fn):
+        start = time.perf_counter()
+        result = fn()
+        seconds[stage] = min(seconds[stage], time.perf_counter() - start)
+        bytes_in[stage] = stage_bytes
+        return result
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            weld_stats = run_pipeline(mesh_arrays, material, file_path, timed)
+    bytes_in['write_to_file'] = os.path.getsize(file_path)
+
+    peak_bytes = {}
+
+    def traced(stage, stage_bytes, fn):
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        result = fn()
+        peak_bytes[stage] = tracemalloc.get_traced_memory()[1] - current
+        return result
+
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            run_pipeline(mesh_arrays, material, file_path, traced)
+    finally:
+        tracemalloc.stop()
+    os.remove(file_path)
+
+    results = {}
+    for stage in STAGES:
+        stage_seconds = max(seconds[stage], 1e-9)
+        results[f"{node_group_name}/{vertex_count}/{stage}"] = {
+            'seconds': round(stage_seconds, 6),
+            'vertices_per_second': round(source_vertices / stage_seconds),
+            'mb_per_second': round(bytes_in[stage] / stage_seconds / 1e6, 2),
+            'peak_mb': round(peak_bytes[stage] / 1e6, 2),
+        }
+    results[f"{node_group_name}/{vertex_count}/total"] = {
+        'seconds': round(sum(seconds.values()), 6),
+        'vertices_per_second': round(source_vertices / sum(seconds.values())),
+        'mb_per_second': round(bytes_in['write_to_file'] / sum(seconds.values()) / 1e6, 2),
+        'peak_mb': round(max(peak_bytes.values()) / 1e6, 2),
+        'source_vertices': source_vertices,
+        'exported_vertices': weld_stats['vertices'],
+        'file_bytes': bytes_in['write_to_file'],
+    }
+    return results
+
+def compare_to_baseline(results, baseline, tolerance):
+    regressions = []
+    for key, result in results.items():
+        reference = baseline.get(key)
+        if reference is None:
+            continue
+        if max(result['seconds'], reference['seconds']) < MIN_COMPARE_SECONDS:
+            continue
+        ratio = result['seconds'] / max(reference['seconds'], 1e-9)
+        result['baseline_ratio'] = round(ratio, 3)
+        if ratio > 1.0 + tolerance:
+            regressions.append((key, ratio))
+    return regressions
+
+def print_table(results):
+    print(f"{'case':<48} {'seconds':>10} {'Mvert/s':>9} {'MB/s':>9} {'peak MB':>9} {'vs base':>8}")
+    for key, result in results.items():
+        ratio = result.get('baseline_ratio')
+        print(f"{key:<48} {result['seconds']:>10.4f} {result['vertices_per_second'] / 1e6:>9.2f} "
+              f"{result['mb_per_second']:>9.1f} {result['peak_mb']:>9.1f} {f'{ratio:.2f}x' if ratio else '':>8}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the RBM export pipeline on synthetic meshes")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help="Vertex counts to test")
+    parser.add_argument('--groups', nargs='+', default=list(MATERIAL_SCHEMAS), choices=list(MATERIAL_SCHEMAS),
+                        help="Node groups to test")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per case; the fastest is kept")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="Baseline JSON to compare against")
+    parser.add_argument('--save-baseline', action='store_true', help="Write these results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed slowdown before a stage counts as a regression")
+    parser.add_argument('--output', default=None, help="Also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for vertex_count in args.sizes:
+            for node_group_name in args.groups:
+                print(f"Benchmarking {node_group_name} with {vertex_count} vertices...")
+                results.update(benchmark_case(node_group_name, vertex_count, max(1, args.repeat), work_dir))
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+        },
+        'results': results,
+    }
+
+    regressions = []
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare_to_baseline(results, json.load(f)['results'], args.tolerance)
+
+    print_table(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    for key, ratio in regressions:
+        print(f"Regression: {key} is {ratio:.2f}x the baseline time")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
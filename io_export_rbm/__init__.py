@@ -8,10 +8,11 @@ bl_info = {
 }
 
 import bpy
-from bpy.props import StringProperty
+from bpy.props import StringProperty, BoolProperty, IntProperty, EnumProperty
 from bpy_extras.io_utils import ExportHelper
 import os
 import sys
+import time
 
 # Ensure the secondary script is in the module search path
 addon_dir = os.path.dirname(__file__)
@@ -20,6 +21,16 @@ if addon_dir not in sys.path:
 
 # Import the secondary script
 import export_rbm_script
+from rbm_assets import AssetIndex
+from rbm_telemetry import ExportTelemetry, set_log_level
+
+# Contents of the bundled asset file, read on first use
+asset_index = AssetIndex(addon_dir)
+
+# Modal export: how often the timer fires, and how long each timer event may work
+# before handing control back to Blender for a redraw
+MODAL_TIMER_SECONDS = 0.01
+MODAL_STEP_SECONDS = 0.1
 
 
 class ExportRBM(bpy.types.Operator, ExportHelper):
@@ -33,25 +44,251 @@ class ExportRBM(bpy.types.Operator, ExportHelper):
         maxlen=255,
     )
 
-    def execute(self, context):
-        supported_nodegroups = ['CARPAINTMM', 'BAVARIUMSHIELD', 'WATERHULL', 'WINDOW', 'CARLIGHT']
-        selected_objects = bpy.context.selected_objects
+    use_streaming: BoolProperty(
+        name="Stream Objects",
+        description="Write each object as soon as it is processed instead of holding the whole selection in memory",
+        default=True,
+    )
+
+    split_mode: EnumProperty(
+        name="Files",
+        description="Write the selection to one file, or one file per collection or object next to it",
+        items=[
+            ('SINGLE', "One File", "Everything selected goes into this file"),
+            ('COLLECTION', "One per Collection", "name_Collection.rbm for every collection with selected objects"),
+            ('OBJECT', "One per Object", "name_Object.rbm for every selected object"),
+        ],
+        default='SINGLE',
+    )
+
+    optimize_vertex_cache: BoolProperty(
+        name="Optimize Vertex Cache",
+        description="Reorder triangles and vertices for GPU vertex cache reuse and report ACMR/ATVR. Runs in Python "
+                    "at about 0.5s per full 65k-vertex block",
+        default=False,
+    )
 
-        objects_data = []
-        for obj in selected_objects:
-            print(f"Processing object: {obj.name}")
-            obj_data = export_rbm_script.process_object(obj, supported_nodegroups)
-            if obj_data:
-                objects_data.append(obj_data)
+    use_geometry_cache: BoolProperty(
+        name="Cache Geometry",
+        description="Keep welded geometry in a .rbm_cache folder next to the file and reuse it for unchanged objects. "
+                    "Modifiers are still evaluated and the mesh is still read; triangulation, tangents and welding "
+                    "are skipped",
+        default=False,
+    )
+
+    pack_workers: IntProperty(
+        name="Packing Threads",
+        description="Threads that weld and pack objects while the next ones are read from Blender. Output is identical for any value",
+        default=export_rbm_script.DEFAULT_PACK_WORKERS,
+        min=1,
+        max=32,
+    )
+
+    log_level: EnumProperty(
+        name="Console Output",
+        description="How much to print to the system console while exporting",
+        items=[
+            ('WARNING', "Warnings", "Only skipped objects and problems"),
+            ('INFO', "Progress", "One line per object and stage"),
+            ('DEBUG', "Debug", "Everything, including every material value and texture path"),
+        ],
+        default='WARNING',
+    )
+
+    lod_levels: StringProperty(
+        name="LOD Levels",
+        description="Comma-separated LODs to write next to the file as _lod1.rbm, _lod2.rbm and so on. "
+                    "Values up to 1 keep that fraction of each object's triangles, larger values are triangle budgets",
+        default="",
+    )
 
-        if objects_data:
-            min_max_positions = export_rbm_script.calculate_global_min_max(objects_data)
-            print(f"Global min and max positions: {min_max_positions}")
+    export_textures: BoolProperty(
+        name="Convert Textures",
+        description="Encode every image used by the exported materials to .dds files with mipmaps, next to the .ddsc "
+                    "paths the file references. Convert them to .ddsc before use. Unchanged images are skipped",
+        default=False,
+    )
 
-            export_rbm_script.write_to_file(self.filepath, objects_data, min_max_positions)
+    texture_folder: StringProperty(
+        name="Texture Folder",
+        description="Folder the material Base Paths are resolved against. Leave empty to use the .rbm's folder",
+        default="",
+        subtype='DIR_PATH',
+    )
+
+    texture_format: EnumProperty(
+        name="Texture Format",
+        description="Compression used for converted textures",
+        items=[
+            ('AUTO', "Auto", "BC1, or BC3 for images with transparency"),
+            ('BC1', "BC1 (DXT1)", "Colour only, 4 bits per pixel"),
+            ('BC3', "BC3 (DXT5)", "Colour and alpha, 8 bits per pixel"),
+            ('RGBA8', "Uncompressed", "32 bits per pixel"),
+        ],
+        default='AUTO',
+    )
+
+    texture_workers: IntProperty(
+        name="Texture Processes",
+        description="Processes that encode textures in parallel",
+        default=export_rbm_script.DEFAULT_TEXTURE_WORKERS,
+        min=1,
+        max=64,
+    )
+
+    write_telemetry: BoolProperty(
+        name="Write Export Stats",
+        description="Save per-stage and per-object timings and block sizes as a .stats.json file next to the .rbm",
+        default=False,
+    )
+
+    interactive: BoolProperty(
+        default=False,
+        options={'HIDDEN', 'SKIP_SAVE'},
+    )
+
+    def invoke(self, context, event):
+        # Exports started from the UI run modally; scripts calling the operator directly block
+        self.interactive = True
+        return ExportHelper.invoke(self, context, event)
+
+    def execute(self, context):
+        set_log_level(self.log_level)
+        try:
+            lod_levels = export_rbm_script.parse_lod_levels(self.lod_levels)
+        except ValueError as e:
+            self.report({'ERROR'}, f"Invalid LOD levels: {e}")
+            return {'CANCELLED'}
+        self._telemetry = ExportTelemetry()
+        self._steps = self.export_steps(context, lod_levels, self._telemetry)
+        # The first step only collects the objects
+        next(self._steps)
+
+        if not self.interactive or context.window is None:
+            export_rbm_script.run_steps(self._steps)
+            return self.finish()
+
+        window_manager = context.window_manager
+        self._timer = window_manager.event_timer_add(MODAL_TIMER_SECONDS, window=context.window)
+        window_manager.modal_handler_add(self)
+        window_manager.progress_begin(0, max(1, self._object_count))
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        if event.type == 'ESC' and event.value == 'PRESS':
+            # Closing the generator unwinds the export: writers discard their temp files
+            # and the packing threads finish the blocks they are on
+            self._steps.close()
+            self.end_modal(context)
+            self.report({'WARNING'}, "Export cancelled; unfinished files were discarded")
+            return {'CANCELLED'}
+        if event.type != 'TIMER':
+            # Navigation, menus and other operators keep working during the export
+            return {'PASS_THROUGH'}
+
+        # Work in slices of at least one step so Blender can redraw between them
+        deadline = time.perf_counter() + MODAL_STEP_SECONDS
+        try:
+            next(self._steps)
+            while time.perf_counter() < deadline:
+                next(self._steps)
+        except StopIteration:
+            self.end_modal(context)
+            return self.finish()
+        except Exception as e:
+            self.end_modal(context)
+            export_rbm_script.log.exception("Export failed")
+            self.report({'ERROR'}, f"Export failed: {e}")
+            return {'CANCELLED'}
+
+        objects, vertices, byte_count = self._telemetry.progress()
+        objects = min(objects, self._object_count)
+        status = (f"Exporting RBM: {objects}/{self._object_count} objects, {vertices} vertices, "
+                  f"{byte_count / 1e6:.1f} MB")
+        if self._telemetry.textures:
+            status += f", {len(self._telemetry.textures)} textures"
+        context.workspace.status_text_set(status + " (Esc to cancel)")
+        context.window_manager.progress_update(objects)
+        return {'RUNNING_MODAL'}
+
+    def end_modal(self, context):
+        window_manager = context.window_manager
+        window_manager.event_timer_remove(self._timer)
+        window_manager.progress_end()
+        context.workspace.status_text_set(None)
+
+    def export_steps(self, context, lod_levels, telemetry):
+        # The whole export as a generator that yields after every written block or
+        # texture. execute runs it to the end; the modal handler a slice at a time
+        supported_nodegroups = list(export_rbm_script.MATERIAL_SCHEMAS)
+        selected_objects = list(context.selected_objects)
+        geometry_cache = None
+        if self.use_geometry_cache:
+            geometry_cache = export_rbm_script.geometry_cache_for(self.filepath)
+
+        groups = None
+        self._object_count = len(selected_objects)
+        if self.split_mode != 'SINGLE':
+            groups = export_rbm_script.group_objects(selected_objects, self.split_mode)
+            self._object_count = sum(len(objects) for _, objects in groups)
+        yield
+
+        if groups is not None:
+            # Multi-file exports always stream
+            yield from export_rbm_script.iter_export_group_files(
+                self.filepath, groups, supported_nodegroups, self.optimize_vertex_cache, geometry_cache,
+                self.pack_workers, telemetry, lod_levels,
+            )
+        elif self.use_streaming:
+            yield from export_rbm_script.iter_export_streaming(
+                self.filepath, selected_objects, supported_nodegroups, self.optimize_vertex_cache, geometry_cache,
+                self.pack_workers, telemetry, lod_levels,
+            )
         else:
-            print("No valid objects to write.")
-        
+            blocks = export_rbm_script.iter_object_blocks(
+                selected_objects, supported_nodegroups, self.optimize_vertex_cache, geometry_cache, self.pack_workers,
+                telemetry=telemetry, lod_levels=lod_levels,
+            )
+            models = [export_rbm_script.RBMModel() for _ in range(len(lod_levels) + 1)]
+            for lod, mesh, _ in blocks:
+                models[lod].meshes.append(mesh)
+                yield
+
+            if models[0].meshes:
+                for lod, model in enumerate(models):
+                    export_rbm_script.log.info(f"LOD {lod} min and max positions: {model.min_max_positions()}")
+                    with telemetry.stage('write'):
+                        export_rbm_script.write_model(
+                            export_rbm_script.lod_path_for(self.filepath, lod), model, telemetry, lod,
+                        )
+                    yield
+            else:
+                export_rbm_script.log.warning("No valid objects to write.")
+            export_rbm_script.report_geometry_cache(geometry_cache, telemetry)
+            telemetry.finish()
+
+        if self.export_textures and telemetry.blocks:
+            yield from export_rbm_script.iter_export_textures(
+                selected_objects, supported_nodegroups,
+                export_rbm_script.texture_root_for(self.filepath, bpy.path.abspath(self.texture_folder)),
+                self.texture_format, self.texture_workers, telemetry,
+            )
+            telemetry.finish()
+
+    def finish(self):
+        telemetry = self._telemetry
+        if telemetry.skipped:
+            self.report({'WARNING'}, f"Skipped {len(telemetry.skipped)}: "
+                                     + ", ".join(f"{item['object']} ({item['reason']})" for item in telemetry.skipped))
+        if not telemetry.blocks:
+            self.report({'WARNING'}, "No valid objects to write.")
+            return {'FINISHED'}
+
+        self.report({'INFO'}, telemetry.report_line())
+        if telemetry.textures:
+            self.report({'INFO'}, "Textures were written as .dds; convert them to .ddsc before using them in the game")
+        if self.write_telemetry:
+            telemetry.dump(export_rbm_script.telemetry_path_for(self.filepath))
         return {'FINISHED'}
 
 
@@ -61,15 +298,11 @@ class AppendNodeGroupOperator(bpy.types.Operator):
     node_group_name: StringProperty()
 
     def execute(self, context):
-        filepath = os.path.join(addon_dir, "assets.blend")
-        with bpy.data.libraries.load(filepath, link=False) as (data_from, data_to):
-            if self.node_group_name in data_from.node_groups:
-                data_to.node_groups = [self.node_group_name]
-            if "ScaleReference" in data_from.objects:
-                data_to.objects = ["ScaleReference"]
-
-        for node_group in data_to.node_groups:
-            print(f"Appended node group: {node_group.name}")
+        try:
+            node_group, appended = asset_index.node_group(self.node_group_name)
+        except (OSError, KeyError) as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
 
         # Add the node group to the active material
         material = context.object.active_material
@@ -80,8 +313,9 @@ class AppendNodeGroupOperator(bpy.types.Operator):
             material.use_nodes = True
         node_tree = material.node_tree
         node = node_tree.nodes.new("ShaderNodeGroup")
-        node.node_tree = bpy.data.node_groups[self.node_group_name]
+        node.node_tree = node_group
 
+        self.report({'INFO'}, f"{'Appended' if appended else 'Reused'} node group {node_group.name}")
         return {'FINISHED'}
 
 
@@ -90,15 +324,17 @@ class AppendScaleReferenceOperator(bpy.types.Operator):
     bl_label = "Add Scale Reference to scene"
 
     def execute(self, context):
-        filepath = os.path.join(addon_dir, "assets.blend")
-        with bpy.data.libraries.load(filepath, link=False) as (data_from, data_to):
-            data_to.objects = [name for name in data_from.objects if name == "ScaleReference"]
-
-        for obj in data_to.objects:
-            if obj is not None:
-                bpy.context.collection.objects.link(obj)
-                print(f"Appended scale reference object: {obj.name}")
-
+        try:
+            obj, appended = asset_index.object("ScaleReference")
+        except (OSError, KeyError) as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+
+        if context.scene in obj.users_scene:
+            self.report({'INFO'}, f"{obj.name} is already in the scene")
+            return {'FINISHED'}
+        context.collection.objects.link(obj)
+        self.report({'INFO'}, f"{'Appended' if appended else 'Added'} scale reference object: {obj.name}")
         return {'FINISHED'}
 
 
@@ -0,0 +1,223 @@
+# Headless batch export.
+#
+# Driver (any Python 3, spreads jobs over several Blender processes):
+#   python batch_export.py manifest.json --blender /path/to/blender --workers 8
+#
+# Manifest:
+#   {"jobs": [{"blend": "cars/car.blend", "output": "out/car.rbm",
+#              "objects": ["Body", "Glass"], "collections": ["Lights"]}]}
+# Relative paths are resolved against the manifest's folder. A job without
+# objects or collections exports every mesh object in the file.
+#
+# Each job runs as:
+#   blender --background --factory-startup car.blend --python batch_export.py -- --job '<json>'
+import argparse
+import concurrent.futures
+import json
+import os
+import subprocess
+import sys
+import time
+
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_NOTHING_EXPORTED = 2
+EXIT_TIMEOUT = 3
+
+def load_manifest(manifest_path):
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    jobs = []
+    for index, job in enumerate(manifest.get('jobs', [])):
+        if 'blend' not in job or 'output' not in job:
+            raise ValueError(f"Job {index} in {manifest_path} needs 'blend' and 'output'")
+        jobs.append({
+            'name': job.get('name', f"{index}:{os.path.basename(job['output'])}"),
+            'blend': os.path.join(base_dir, job['blend']),
+            'output': os.path.join(base_dir, job['output']),
+            'objects': list(job.get('objects', [])),
+            'collections': list(job.get('collections', [])),
+            'optimize_vertex_cache': bool(job.get('optimize_vertex_cache', False)),
+            'use_geometry_cache': bool(job.get('use_geometry_cache', False)),
+            'pack_workers': max(1, int(job.get('pack_workers', 1))),
+            'lod_levels': [float(level) for level in job.get('lod_levels', [])],
+            'split': str(job.get('split', 'single')).upper(),
+            'export_textures': bool(job.get('export_textures', False)),
+            'texture_folder': os.path.join(base_dir, job['texture_folder']) if job.get('texture_folder') else '',
+            'texture_format': job.get('texture_format', 'AUTO'),
+            'texture_workers': max(1, int(job.get('texture_workers', 1))),
+            'log_level': job.get('log_level', 'INFO'),
+            'write_telemetry': bool(job.get('write_telemetry', False)),
+        })
+    return jobs
+
+def run_job(blender, job, timeout=None):
+    worker_job = {
+        key: job[key] for key in (
+            'output', 'objects', 'collections', 'optimize_vertex_cache', 'use_geometry_cache', 'pack_workers', 'lod_levels',
+            'split', 'export_textures', 'texture_folder', 'texture_format', 'texture_workers', 'log_level', 'write_telemetry',
+        )
+    }
+    command = [
+        blender, '--background', '--factory-startup', job['blend'],
+        '--python', os.path.abspath(__file__),
+        '--', '--job', json.dumps(worker_job),
+    ]
+    os.makedirs(os.path.dirname(job['output']) or '.', exist_ok=True)
+
+    start = time.perf_counter()
+    try:
+        completed = subprocess.run(command, capture_output=True, text=True, timeout=timeout)
+        exit_code = completed.returncode
+        output = completed.stdout + completed.stderr
+    except subprocess.TimeoutExpired as e:
+        exit_code = EXIT_TIMEOUT
+        output = f"Timed out after {timeout} seconds\n{e.stdout or ''}{e.stderr or ''}"
+    except OSError as e:
+        exit_code = EXIT_ERROR
+        output = f"Could not start Blender: {e}"
+
+    return {
+        'name': job['name'],
+        'blend': job['blend'],
+        'output': job['output'],
+        'exit_code': exit_code,
+        'seconds': round(time.perf_counter() - start, 3),
+        'ok': exit_code == EXIT_OK,
+        'log_tail': output.splitlines()[-20:],
+    }
+
+def run_batch(jobs, blender, workers, timeout=None):
+    results = [None] * len(jobs)
+    # Each worker thread only waits on its Blender process, so threads are enough here
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_job, blender, job, timeout): i for i, job in enumerate(jobs)}
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            results[futures[future]] = result
+            status = "ok" if result['ok'] else f"FAILED (exit {result['exit_code']})"
+            print(f"[{sum(r is not None for r in results)}/{len(jobs)}] {result['name']}: {status} in {result['seconds']:.2f}s")
+    return results
+
+def summarize(results, wall_seconds):
+    failed = [result for result in results if not result['ok']]
+    return {
+        'jobs': len(results),
+        'succeeded': len(results) - len(failed),
+        'failed': len(failed),
+        'wall_seconds': round(wall_seconds, 3),
+        'job_seconds': round(sum(result['seconds'] for result in results), 3),
+        'results': results,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export RBM files from .blend files with a pool of Blender processes")
+    parser.add_argument('manifest', help="JSON manifest listing the jobs")
+    parser.add_argument('--blender', default=os.environ.get('BLENDER', 'blender'), help="Blender executable")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Number of Blender processes to run at once")
+    parser.add_argument('--timeout', type=float, default=None, help="Seconds before a job is killed")
+    parser.add_argument('--summary', default=None, help="Write the JSON summary to this file")
+    args = parser.parse_args(argv)
+
+    jobs = load_manifest(args.manifest)
+    print(f"Running {len(jobs)} jobs on {args.workers} workers")
+    start = time.perf_counter()
+    results = run_batch(jobs, args.blender, max(1, args.workers), args.timeout)
+    summary = summarize(results, time.perf_counter() - start)
+
+    for result in results:
+        if not result['ok']:
+            print(f"Failed: {result['name']} ({result['blend']}), exit {result['exit_code']}")
+            for line in result['log_tail']:
+                print(f"    {line}")
+    print(f"{summary['succeeded']}/{summary['jobs']} jobs succeeded in {summary['wall_seconds']:.2f}s "
+          f"({summary['job_seconds']:.2f}s of Blender time)")
+
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+    return EXIT_OK if summary['failed'] == 0 else EXIT_ERROR
+
+def select_job_objects(bpy, job):
+    if not job['objects'] and not job['collections']:
+        return [obj for obj in bpy.data.objects if obj.type == 'MESH']
+
+    objects = []
+    for name in job['objects']:
+        obj = bpy.data.objects.get(name)
+        if obj is None:
+            raise KeyError(f"Object '{name}' not found")
+        objects.append(obj)
+    for name in job['collections']:
+        collection = bpy.data.collections.get(name)
+        if collection is None:
+            raise KeyError(f"Collection '{name}' not found")
+        objects.extend(obj for obj in collection.all_objects if obj.type == 'MESH')
+
+    # Keep the first occurrence of objects listed more than once
+    unique_objects = []
+    seen = set()
+    for obj in objects:
+        if obj.name not in seen:
+            seen.add(obj.name)
+            unique_objects.append(obj)
+    return unique_objects
+
+def worker_main(argv):
+    import bpy
+
+    addon_dir = os.path.dirname(os.path.abspath(__file__))
+    if addon_dir not in sys.path:
+        sys.path.append(addon_dir)
+    import export_rbm_script
+    from rbm_telemetry import ExportTelemetry, set_log_level
+
+    parser = argparse.ArgumentParser(prog="batch_export.py (worker)")
+    parser.add_argument('--job', required=True)
+    job = json.loads(parser.parse_args(argv).job)
+
+    set_log_level(job.get('log_level', 'INFO'))
+    telemetry = ExportTelemetry()
+    try:
+        objects = select_job_objects(bpy, job)
+        supported_nodegroups = list(export_rbm_script.MATERIAL_SCHEMAS)
+        geometry_cache = None
+        if job.get('use_geometry_cache'):
+            geometry_cache = export_rbm_script.geometry_cache_for(job['output'])
+        if job.get('split', 'SINGLE') != 'SINGLE':
+            written = export_rbm_script.export_group_files(
+                job['output'], export_rbm_script.group_objects(objects, job['split']), supported_nodegroups,
+                job.get('optimize_vertex_cache', False), geometry_cache, job.get('pack_workers', 1), telemetry,
+                job.get('lod_levels', []),
+            ) or None
+        else:
+            written = export_rbm_script.export_streaming(
+                job['output'], objects, supported_nodegroups, job.get('optimize_vertex_cache', False), geometry_cache,
+                job.get('pack_workers', 1), telemetry, job.get('lod_levels', []),
+            )
+        if written is not None and job.get('export_textures'):
+            export_rbm_script.export_textures(
+                objects, supported_nodegroups,
+                export_rbm_script.texture_root_for(job['output'], job.get('texture_folder', '')),
+                job.get('texture_format', 'AUTO'), job.get('texture_workers', 1), telemetry,
+            )
+            telemetry.finish()
+        if written is not None and job.get('write_telemetry'):
+            telemetry.dump(export_rbm_script.telemetry_path_for(job['output']))
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        print(f"Export failed: {e}")
+        return EXIT_ERROR
+
+    if written is not None:
+        print(telemetry.report_line())
+    return EXIT_OK if written is not None else EXIT_NOTHING_EXPORTED
+
+if __name__ == "__main__":
+    if '--' in sys.argv and '--job' in sys.argv[sys.argv.index('--') + 1:]:
+        sys.exit(worker_main(sys.argv[sys.argv.index('--') + 1:]))
+    sys.exit(main())
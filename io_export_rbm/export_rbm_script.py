@@ -1,554 +1,864 @@
 import bpy
-import bmesh
-import struct
+import copy
+import hashlib
+import logging
 import math
 import mathutils
+import multiprocessing
 import os
+import queue
+import re
+from collections import deque
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+from rbm_format import (
+    compress_normal, MATERIAL_SCHEMAS, MATERIAL_BLOCK_CACHE, RBMStreamWriter, calculate_global_min_max,
+    pack_block, write_model, write_to_file,
+)
+from rbm_model import RBMMaterial, RBMMesh, RBMModel
+from rbm_cache import GeometryCache, InstanceCache, TextureCache, fingerprint_arrays, instance_key
+from rbm_mesh import (
+    MAX_BLOCK_VERTICES, build_geometry, decimate, lod_triangle_target, loop_tangents, parse_lod_levels,
+    split_into_blocks, optimize_vertex_cache,
+)
+from rbm_telemetry import ExportTelemetry, log
+from rbm_textures import TEXTURE_ENCODER_VERSION, TEXTURE_FILE_EXTENSION, encode_texture_file, resolve_texture_format
+
+__all__ = [
+    # Used by the add-on operators and batch_export.py
+    'DEFAULT_PACK_WORKERS', 'DEFAULT_TEXTURE_WORKERS', 'MATERIAL_SCHEMAS', 'export_group_files', 'export_streaming',
+    'export_textures', 'geometry_cache_for', 'group_objects', 'iter_export_group_files', 'iter_export_streaming',
+    'iter_export_textures', 'iter_object_blocks', 'lod_path_for', 'log', 'report_geometry_cache', 'run_steps',
+    'telemetry_path_for', 'texture_root_for',
+    # Defined in rbm_model, rbm_format and rbm_mesh; re-exported for the operators' buffered export
+    'RBMModel', 'parse_lod_levels', 'write_model',
+    # The original exporter's entry points. The last three now live in rbm_format and are
+    # only re-exported here, for scripts written against the single-module exporter
+    'process_object', 'calculate_global_min_max', 'compress_normal', 'write_to_file',
+]
+
+# Part of the geometry cache key; bump it whenever build_geometry output changes
+EXPORTER_VERSION = 2
+
+# Folder next to the exported file that holds the on-disk geometry cache
+GEOMETRY_CACHE_DIR = '.rbm_cache'
+
+# Default number of threads that weld and pack objects while bpy extraction continues
+DEFAULT_PACK_WORKERS = min(4, os.cpu_count() or 1)
+
+# Default number of threads writing files in multi-file exports
+DEFAULT_WRITE_WORKERS = 2
+
+# Packed blocks waiting for a writer thread, per file
+WRITE_QUEUE_BLOCKS = 64
+
+# A LOD that keeps more than this multiple of its triangle target is reported as missed.
+# decimate stops early when only seam, border and hard-edge vertices are left to move
+LOD_TARGET_MISS_RATIO = 1.25
+
+# Default number of processes that encode textures to DDS
+DEFAULT_TEXTURE_WORKERS = min(8, os.cpu_count() or 1)
+
+# Optional per-export stats file written next to the .rbm
+TELEMETRY_SUFFIX = '.stats.json'
+
+ROTATION_MATRIX = mathutils.Matrix.Rotation(-math.pi / 2, 4, 'X')
+
+MATERIAL_FLAGS = {
+    'SUPPORT_DECALS': 0x1,
+    'SUPPORT_DAMAGE_BLEND': 0x2,
+    'SUPPORT_DIRT': 0x4,
+    'SUPPORT_PALETTE_FILE': 0x8,
+    'SUPPORT_SOFT_TINT': 0x10,
+    'SUPPORT_LAYERED': 0x20,
+    'SUPPORT_OVERLAY': 0x40,
+    'DISABLE_BACKFACE_CULLING': 0x80,
+    'TRANSPARENCY_ALPHABLENDING': 0x100,
+    'TRANSPARENCY_ALPHATESTING': 0x200,
+    'IS_DEFORM': 0x1000,
+    'IS_SKINNED': 0x2000,
+}
 
 def get_image_from_input(input_socket):
     if input_socket.is_linked:
         from_node = input_socket.links[0].from_node
-        if from_node.type == 'TEX_IMAGE':
+        if from_node.type == 'TEX_IMAGE' and from_node.image:
             return from_node.image.name
     return None
 
-def get_texture_paths(material, group_name):
-    texture_names_by_group = {
-        'CARPAINTMM': [
-            'DiffuseMap', 'NormalMap', 'PropertyMap', 'TintMap', 'DamageNormalMap',
-            'DamageAlbedoMap', 'DirtMap', 'DecalAlbedoMap', 'DecalNormalMap',
-            'DecalPropertyMap', 'LayeredAlbedoMap', 'OverlayAlbedoMap'
-        ],
-        'WINDOW': [
-            'DiffuseMap', 'NormalMap', 'PropertyMap', 'DamagePointNormal', 
-            'DamagePointProperty', 'DamageTileNormal', 'DamageTileProperty'
-        ],
-        'CARLIGHT': [
-            'DiffuseMap', 'NormalMap', 'PropertyMap', 'UNKNOWN', 'NormalDetailMap', 
-            'EmmisiveMap'
-        ]
-    }
-
-    base_path = ''
-    texture_paths = []
+def find_node_group(material, supported_nodegroups):
+    if not material.use_nodes or not material.node_tree:
+        return None
+    for node in material.node_tree.nodes:
+        if node.type == 'GROUP' and node.node_tree and node.node_tree.name in supported_nodegroups:
+            return node
+    return None
 
-    if not material.node_tree:
-        return texture_paths
-    
-    node_tree = material.node_tree
-    node_group = None
-    
-    for node in node_tree.nodes:
-        if node.type == 'GROUP' and node.node_tree.name == group_name:
-            node_group = node
-            break
-    
-    if node_group:
-        for input in node_group.inputs:
-            if input.name == 'Base Path':
-                base_path = input.default_value
-                break
+def snapshot_material(material, supported_nodegroups):
+    # Read the group node and its inputs once; everything the exporter needs from
+    # the material is taken from this snapshot
+    node_group = find_node_group(material, supported_nodegroups)
+    if node_group is None:
+        return None
 
-        texture_names = texture_names_by_group.get(group_name, [])
-        for texture_name in texture_names:
-            path_length = 0
-            path = ''
-            for input in node_group.inputs:
-                if input.name == texture_name:
-                    image_name = get_image_from_input(input)
-                    if image_name:
-                        # Remove the current extension and change it to .ddsc
-                        base_name, _ = os.path.splitext(image_name)
-                        new_image_name = f"{base_name}.ddsc"
-                        path = f"{base_path}/{new_image_name}"
-                        path_length = len(path.encode('utf-8'))
-            texture_paths.append((path_length, path))
-    
+    snapshot = {
+        'node_group_name': node_group.node_tree.name,
+        'base_path': None,
+        'inputs_by_type': {},
+        'images': {},
+        'node_values': {},
+        'color_values': {},
+        'boolean_values': {},
+    }
+    for input in node_group.inputs:
+        if input.name == 'Base Path' and snapshot['base_path'] is None:
+            snapshot['base_path'] = input.default_value
+        if hasattr(input, 'default_value'):
+            value = input.default_value
+            if input.type in ('VECTOR', 'RGBA'):
+                value = tuple(value)
+            snapshot['inputs_by_type'].setdefault(input.type, {})[input.name] = value
+        if input.is_linked:
+            snapshot['images'][input.name] = get_image_from_input(input)
+
+    inputs_by_type = snapshot['inputs_by_type']
+    snapshot['node_values'].update(inputs_by_type.get('VALUE', {}))
+    snapshot['node_values'].update(inputs_by_type.get('VECTOR', {}))
+    snapshot['color_values'].update(inputs_by_type.get('RGBA', {}))
+    snapshot['boolean_values'].update(inputs_by_type.get('BOOLEAN', {}))
+    if snapshot['base_path'] is None:
+        snapshot['base_path'] = ''
+    snapshot['flags_value'] = calculate_flags(snapshot)
+    snapshot['texture_paths'] = get_texture_paths(snapshot)
+    snapshot['content_hash'] = material_content_hash(snapshot)
+    return snapshot
+
+def material_content_hash(snapshot):
+    # Everything written to the material block is derived from the input values and
+    # linked images, so any change to them produces a new hash
+    content = (
+        snapshot['node_group_name'],
+        sorted((socket_type, sorted(inputs.items())) for socket_type, inputs in snapshot['inputs_by_type'].items()),
+        sorted(snapshot['images'].items(), key=lambda item: (item[0], item[1] or '')),
+    )
+    return hashlib.sha1(repr(content).encode('utf-8')).hexdigest()
+
+def get_material_snapshot(material, supported_nodegroups, material_cache=None):
+    if material_cache is None:
+        return snapshot_material(material, supported_nodegroups)
+    key = material.as_pointer()
+    if key not in material_cache:
+        material_cache[key] = snapshot_material(material, supported_nodegroups)
+    return material_cache[key]
+
+def get_texture_paths(snapshot):
+    texture_paths = []
+    base_path = snapshot['base_path']
+    for texture_name in MATERIAL_SCHEMAS[snapshot['node_group_name']]['texture_slots']:
+        path_length = 0
+        path = ''
+        image_name = snapshot['images'].get(texture_name)
+        if image_name:
+            path = texture_path_for(base_path, image_name)
+            path_length = len(path.encode('utf-8'))
+        texture_paths.append((path_length, path))
     return texture_paths
 
-def get_node_values(material, group_name):
-    node_values = {}
-    node_tree = material.node_tree
-    node_group = None
-    
-    for node in node_tree.nodes:
-        if node.type == 'GROUP' and node.node_tree.name == group_name:
-            node_group = node
-            break
+def texture_path_for(base_path, image_name):
+    # Remove the current extension and change it to .ddsc
+    base_name, _ = os.path.splitext(image_name)
+    return f"{base_path}/{base_name}.ddsc"
 
-    if node_group:
-        for input in node_group.inputs:
-            if input.type == 'VALUE':
-                node_values[input.name] = input.default_value
-            elif input.type == 'VECTOR':
-                node_values[input.name] = tuple(input.default_value)
-    
-    return node_values
-
-def get_color_values(material, group_name):
-    color_values = {}
-    node_tree = material.node_tree
-    node_group = None
-
-    for node in node_tree.nodes:
-        if node.type == 'GROUP' and node.node_tree.name == group_name:
-            node_group = node
-            break
-
-    if node_group:
-        for input in node_group.inputs:
-            if input.type == 'RGBA':
-                color_values[input.name] = tuple(input.default_value)
-
-    return color_values
-
-def get_boolean_values(material, group_name):
-    boolean_values = {}
-    node_tree = material.node_tree
-    node_group = None
-    
-    for node in node_tree.nodes:
-        if node.type == 'GROUP' and node.node_tree.name == group_name:
-            node_group = node
-            break
+def calculate_flags(snapshot):
+    flag_value = 0
+    if snapshot['node_group_name'] == 'CARPAINTMM':
+        for inputs in snapshot['inputs_by_type'].values():
+            for name, value in inputs.items():
+                if name in MATERIAL_FLAGS and value:
+                    flag_value += MATERIAL_FLAGS[name]
+    return flag_value
 
-    if node_group:
-        for input in node_group.inputs:
-            if input.type == 'BOOLEAN':
-                boolean_values[input.name] = input.default_value
-    
-    return boolean_values
-
-def calculate_flags(material):
-    flags = {
-        'SUPPORT_DECALS': 0x1,
-        'SUPPORT_DAMAGE_BLEND': 0x2,
-        'SUPPORT_DIRT': 0x4,
-        'SUPPORT_PALETTE_FILE': 0x8,
-        'SUPPORT_SOFT_TINT': 0x10,
-        'SUPPORT_LAYERED': 0x20,
-        'SUPPORT_OVERLAY': 0x40,
-        'DISABLE_BACKFACE_CULLING': 0x80,
-        'TRANSPARENCY_ALPHABLENDING': 0x100,
-        'TRANSPARENCY_ALPHATESTING': 0x200,
-        'IS_DEFORM': 0x1000,
-        'IS_SKINNED': 0x2000,
+def extract_loop_tangents(mesh, positions, loop_vertex_indices, triangle_loops, normals, uv_layers):
+    # Tangents follow the first UV layer, the one written as uv1. Loop tangents are only
+    # valid after calc_tangents, which needs a UV layer and faces of at most four
+    # corners; other meshes get the NumPy equivalent from rbm_mesh.loop_tangents
+    loop_count = len(loop_vertex_indices)
+    if uv_layers and len(triangle_loops):
+        try:
+            mesh.calc_tangents(uvmap=mesh.uv_layers[0].name)
+        except RuntimeError as e:
+            log.info(f"Mesh {mesh.name}: calc_tangents unavailable ({e}), computing tangents with NumPy")
+        else:
+            tangents = np.empty(loop_count * 3, dtype=np.float32)
+            mesh.loops.foreach_get('tangent', tangents)
+            bitangent_signs = np.empty(loop_count, dtype=np.float32)
+            mesh.loops.foreach_get('bitangent_sign', bitangent_signs)
+            mesh.free_tangents()
+            return tangents.reshape(-1, 3), bitangent_signs
+    return loop_tangents(positions, loop_vertex_indices, triangle_loops, normals, uv_layers[0] if uv_layers else None)
+
+def read_mesh_buffers(mesh):
+    # The raw buffers every exported attribute is derived from. They are cheap to read,
+    # so the geometry cache key is taken from these before any triangulation or tangents
+    vertex_count = len(mesh.vertices)
+    loop_count = len(mesh.loops)
+    polygon_count = len(mesh.polygons)
+
+    positions = np.empty(vertex_count * 3, dtype=np.float32)
+    mesh.vertices.foreach_get('co', positions)
+
+    loop_vertex_indices = np.empty(loop_count, dtype=np.int32)
+    mesh.loops.foreach_get('vertex_index', loop_vertex_indices)
+
+    polygon_loop_starts = np.empty(polygon_count, dtype=np.int32)
+    mesh.polygons.foreach_get('loop_start', polygon_loop_starts)
+    polygon_loop_totals = np.empty(polygon_count, dtype=np.int32)
+    mesh.polygons.foreach_get('loop_total', polygon_loop_totals)
+
+    uv_layers = []
+    for uv_layer in mesh.uv_layers:
+        uv = np.empty(loop_count * 2, dtype=np.float32)
+        uv_layer.data.foreach_get('uv', uv)
+        uv_layers.append(uv.reshape(-1, 2))
+
+    normals = np.empty(loop_count * 3, dtype=np.float32)
+    mesh.loops.foreach_get('normal', normals)
+
+    return {
+        'positions': positions.reshape(-1, 3),
+        'loop_vertex_indices': loop_vertex_indices,
+        'polygon_loop_starts': polygon_loop_starts,
+        'polygon_loop_totals': polygon_loop_totals,
+        'uv_layers': uv_layers,
+        'normals': normals.reshape(-1, 3),
     }
 
-    flag_value = 0
-    if material.use_nodes:
-        for node in material.node_tree.nodes:
-            if node.type == 'GROUP' and node.node_tree.name == 'CARPAINTMM':
-                for input in node.inputs:
-                    if input.name in flags and input.default_value:
-                        flag_value += flags[input.name]
-    return flag_value
+def finish_mesh_arrays(mesh, buffers):
+    # Triangles, tangents and the export rotation, for meshes not found in the cache
+    positions = buffers['positions']
+    loop_vertex_indices = buffers['loop_vertex_indices']
+    uv_layers = buffers['uv_layers']
+    normals = buffers['normals']
+
+    mesh.calc_loop_triangles()
+    triangle_loops = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int32)
+    mesh.loop_triangles.foreach_get('loops', triangle_loops)
+
+    tangents, bitangent_signs = extract_loop_tangents(mesh, positions, loop_vertex_indices, triangle_loops, normals,
+                                                      uv_layers)
+
+    # Rotate -90 degrees around X in one pass, matching the old per-vertex mathutils multiply
+    rotation = np.array(ROTATION_MATRIX.to_3x3(), dtype=np.float32).astype(np.float64)
+    positions = (positions.astype(np.float64) @ rotation.T).astype(np.float32)
+    normals = (normals.astype(np.float64) @ rotation.T).astype(np.float32)
+    tangents = (tangents.reshape(-1, 3).astype(np.float64) @ rotation.T).astype(np.float32)
+
+    return {
+        'vertices': positions,
+        'loop_vertex_indices': loop_vertex_indices,
+        'triangle_loops': triangle_loops.reshape(-1, 3),
+        'uv_layers': uv_layers,
+        'normals': normals,
+        'tangents': tangents,
+        'bitangent_signs': bitangent_signs,
+    }
 
-def compress_normal(vec):
-    x = math.floor((vec.x + 1.0) * 127.0) / 256.0
-    y = math.floor((vec.y + 1.0) * 127.0)
-    z = math.floor((vec.z + 1.0) * 127.0) * 256.0
-    return x + y + z
+def extract_mesh_arrays(mesh):
+    return finish_mesh_arrays(mesh, read_mesh_buffers(mesh))
+
+def extract_object_arrays(obj, geometry_cache=None):
+    # Work on a temporary evaluated mesh owned by the object; it is released even if
+    # extraction fails, so exports never leave orphan meshes in bpy.data.meshes.
+    # Returns (mesh_arrays, cached geometry, cache key), or None for objects without a
+    # mesh. On a cache hit mesh_arrays is None: nothing past the raw buffers is computed
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    obj_eval = obj.evaluated_get(depsgraph)
+    mesh = obj_eval.to_mesh()
+    try:
+        if mesh is None:
+            return None
+        buffers = read_mesh_buffers(mesh)
+        cache_key = None
+        if geometry_cache is not None:
+            cache_key = geometry_fingerprint(buffers)
+            geometry = geometry_cache.load(cache_key)
+            if geometry is not None:
+                return None, geometry, cache_key
+        return finish_mesh_arrays(mesh, buffers), None, cache_key
+    finally:
+        obj_eval.to_mesh_clear()
+
+def geometry_fingerprint(buffers):
+    # Geometry is exported in object space, so the object's transform is not part of
+    # the key: moving or rotating an object still hits the cache
+    arrays = [
+        buffers['positions'],
+        buffers['loop_vertex_indices'],
+        buffers['polygon_loop_starts'],
+        buffers['polygon_loop_totals'],
+        buffers['normals'],
+    ] + buffers['uv_layers']
+    return fingerprint_arrays(arrays, extra=(EXPORTER_VERSION, len(buffers['uv_layers'])))
+
+def skip_object(obj, reason, telemetry=None):
+    log.warning(f"Skipping {obj.name}: {reason}")
+    if telemetry is not None:
+        telemetry.skip(obj.name, reason)
+    return None
 
-def process_object(obj, supported_nodegroups):
+def gather_object(obj, supported_nodegroups, material_cache=None, geometry_cache=None, telemetry=None,
+                  instance_cache=None):
+    # Everything that touches bpy happens here, on the calling thread. The returned job
+    # holds plain Python values and NumPy arrays only, so pack_object can run in a worker
     material = obj.active_material
     if material is None:
-        print(f"Object {obj.name} has no material.")
-        return None
-
-    node_group_name = None
-    if material.use_nodes:
-        for node in material.node_tree.nodes:
-            if node.type == 'GROUP' and node.node_tree.name in supported_nodegroups:
-                node_group_name = node.node_tree.name
-                break
-
-    if not node_group_name:
-        print(f"No supported node group found in the material of {obj.name}.")
-        return None
-
-    flags_value = calculate_flags(material)
-    print(f"Object: {obj.name}, Node Group: {node_group_name}, Calculated flags value: {flags_value:#010x}")
-
-    texture_paths = get_texture_paths(material, node_group_name)
-    print(f"Object: {obj.name}, Texture paths:")
-    for length, path in texture_paths:
-        print(f"Length: {length}, Path: {path}")
-
-    node_values = get_node_values(material, node_group_name)
-    print(f"Object: {obj.name}, Node values:")
-    for name, value in node_values.items():
-        print(f"Name: {name}, Value: {value}")
-
-    color_values = get_color_values(material, node_group_name)
-    print(f"Object: {obj.name}, Color values:")
-    for name, value in color_values.items():
-        print(f"Name: {name}, Value: {value}")
-
-    boolean_values = get_boolean_values(material, node_group_name)
-    print(f"Object: {obj.name}, Boolean values:")
-    for name, value in boolean_values.items():
-        print(f"Name: {name}, Value: {value}")
-
-    mesh_copy = obj.data.copy()
-    bm = bmesh.new()
-    bm.from_mesh(mesh_copy)
-    bmesh.ops.triangulate(bm, faces=bm.faces[:])
-    rotation_matrix = mathutils.Matrix.Rotation(-math.pi / 2, 4, 'X')
-
-    for v in bm.verts:
-        v.co = rotation_matrix @ v.co
-
-    bm.to_mesh(mesh_copy)
-    bm.free()
-    mesh_copy.update()
-    bm = bmesh.new()
-    bm.from_mesh(mesh_copy)
-
-    vertices = [(v.co.x, v.co.y, v.co.z) for v in bm.verts]
-
-    uv1 = [(0, 0)] * len(vertices)
-    uv2 = [(0, 0)] * len(vertices)
-    uv3 = [(0, 0)] * len(vertices)
-    normals = [0.0] * len(vertices)
-    tangents = [0.0] * len(vertices)
-
-    uv_layers = bm.loops.layers.uv
-    uv1_layer = uv_layers[0] if len(uv_layers) > 0 else None
-    uv2_layer = uv_layers[1] if len(uv_layers) > 1 else None
-    uv3_layer = uv_layers[2] if len(uv_layers) > 2 else None
-
-    for face in bm.faces:
-        for loop in face.loops:
-            idx = loop.vert.index
-            if uv1_layer:
-                uv = loop[uv1_layer].uv
-                uv1[idx] = (uv.x, -uv.y)
-            if uv2_layer:
-                uv = loop[uv2_layer].uv
-                uv2[idx] = (uv.x, -uv.y)
-            if uv3_layer:
-                uv = loop[uv3_layer].uv
-                uv3[idx] = (uv.x, -uv.y)
-
-    for loop in mesh_copy.loops:
-        idx = loop.vertex_index
-        normal = loop.normal
-        tangent = loop.tangent
-        bitangent_sign = -loop.bitangent_sign
-
-        normals[idx] = compress_normal(normal)
-        tangents[idx] = math.copysign(compress_normal(tangent), -bitangent_sign)
-
-    faces = [tuple(vert.index for vert in face.verts) for face in bm.faces]
-    face_indices_count = len(faces) * 3
-
-    bm.free()
-
-    object_data = {
-        'vertices': vertices,
+        return skip_object(obj, "no material", telemetry)
+
+    snapshot = get_material_snapshot(material, supported_nodegroups, material_cache)
+    if snapshot is None:
+        return skip_object(obj, "no supported node group in its material", telemetry)
+
+    node_group_name = snapshot['node_group_name']
+    flags_value = snapshot['flags_value']
+    log.info(f"Object: {obj.name}, Node Group: {node_group_name}, Calculated flags value: {flags_value:#010x}")
+
+    texture_paths = snapshot['texture_paths']
+    node_values = snapshot['node_values']
+    color_values = snapshot['color_values']
+    boolean_values = snapshot['boolean_values']
+    if log.isEnabledFor(logging.DEBUG):
+        for length, path in texture_paths:
+            log.debug(f"Object: {obj.name}, Texture path: {path} (length {length})")
+        for values in (node_values, color_values, boolean_values):
+            for name, value in values.items():
+                log.debug(f"Object: {obj.name}, {name}: {value}")
+
+    material_data = {
         'flags_value': flags_value,
         'texture_paths': texture_paths,
-        'normals': normals,
-        'tangents': tangents,
-        'uv1': uv1,
-        'uv2': uv2,
-        'uv3': uv3,
-        'faces': faces,
-        'face_indices_count': face_indices_count,
         'node_group_name': node_group_name,
         'node_values': node_values,
         'color_values': color_values,
         'boolean_values': boolean_values,
+        'material_key': snapshot['content_hash'],
+    }
+
+    claimed_key = None
+    key = instance_key(obj) if instance_cache is not None else None
+    if key is not None:
+        if not instance_cache.claim(key, obj.name):
+            log.info(f"Object: {obj.name}, instance of {instance_cache.source(key)}")
+            return {'name': obj.name, 'instance_of': key, 'material': material_data}
+        claimed_key = key
+
+    try:
+        extracted = extract_object_arrays(obj, geometry_cache)
+    except BaseException:
+        if claimed_key is not None:
+            instance_cache.abandon(claimed_key)
+        raise
+    reason = None
+    if extracted is None:
+        reason = "no mesh data"
+    else:
+        mesh_arrays, geometry, cache_key = extracted
+        if geometry is None and not len(mesh_arrays['triangle_loops']):
+            reason = "no faces"
+    if reason is not None:
+        if claimed_key is not None:
+            instance_cache.abandon(claimed_key, reason)
+        return skip_object(obj, reason, telemetry)
+    if geometry is not None:
+        log.info(f"Object: {obj.name}, geometry loaded from cache")
+
+    return {
+        'name': obj.name,
+        'mesh_arrays': mesh_arrays,
+        'geometry': geometry,
+        'cache_key': cache_key,
+        'instance_key': claimed_key,
+        'material': material_data,
     }
 
+def finish_object(job, geometry_cache=None, telemetry=None):
+    geometry = job['geometry']
+    if geometry is None:
+        geometry = build_geometry(job['mesh_arrays'])
+        if job['cache_key'] is not None:
+            geometry_cache.store(job['cache_key'], geometry)
+
+    weld_stats = geometry['weld_stats']
+    log.info(f"Object: {job['name']}, {weld_stats['loops']} loops from {weld_stats['source_vertices']} vertices -> "
+             f"{weld_stats['vertices']} vertices ({weld_stats['splits']} split, {weld_stats['welds']} welded)")
+    if telemetry is not None:
+        telemetry.add_weld(job['name'], weld_stats)
+
+    object_data = {
+        'vertices': geometry['vertices'],
+        'normals': geometry['normals'],
+        'tangents': geometry['tangents'],
+        'uv1': geometry['uv1'],
+        'uv2': geometry['uv2'],
+        'uv3': geometry['uv3'],
+        'faces': geometry['faces'],
+        'face_indices_count': len(geometry['faces']) * 3,
+        'weld_stats': weld_stats,
+        'object_name': job['name'],
+    }
+    object_data.update(job['material'])
+
     return object_data
 
-def calculate_global_min_max(objects_data):
-    all_vertices = [v for obj_data in objects_data for v in obj_data['vertices']]
-    min_x = min(v[0] for v in all_vertices)
-    min_y = min(v[1] for v in all_vertices)
-    min_z = min(v[2] for v in all_vertices)
-    max_x = max(v[0] for v in all_vertices)
-    max_y = max(v[1] for v in all_vertices)
-    max_z = max(v[2] for v in all_vertices)
-    return min_x, min_y, min_z, max_x, max_y, max_z
-
-def write_to_file(file_path, objects_data, min_max_positions):
-    print("Writing data to file...")
-    with open(file_path, "wb") as f:
-        header = bytes.fromhex("0500000052424D444C010000001000000000000000")
-        f.write(header)
-
-        f.write(struct.pack('<6f', *min_max_positions))
-
-        f.write(struct.pack('<I', len(objects_data)))
-
-        f.write(struct.pack('<I', 8))
-
-        for obj_data in objects_data:
-            print(f"Writing data for object with node group {obj_data['node_group_name']}")
-
-            if obj_data['node_group_name'] == 'CARPAINTMM':
-                additional_block_start = bytes.fromhex("D60433480E")
-                f.write(additional_block_start)
-                f.write(struct.pack('<I', obj_data['flags_value']))
-                f.write(struct.pack('<f', 1.0))
-                
-                node_values = obj_data['node_values']
-                color_values = obj_data['color_values']
-                boolean_values = obj_data['boolean_values']
-                specular_gloss_global = struct.pack('<f', node_values.get('SpecularGlossGlobal', 0.0))
-                specular_gloss_zones = struct.pack('<3f', *node_values.get('SpecularGlossZones', (0.0, 0.0, 0.0)))
-                metallic_global = struct.pack('<f', node_values.get('MetallicGlobal', 0.0))
-                metallic_zones = struct.pack('<3f', *node_values.get('MetallicZones', (0.0, 0.0, 0.0)))
-                clearcoat_global = struct.pack('<f', node_values.get('ClearCoatGlobal', 0.0))
-                clearcoat_zones = struct.pack('<3f', *node_values.get('ClearCoatZones', (0.0, 0.0, 0.0)))
-                emissive_global = struct.pack('<f', node_values.get('EmissiveGlobal', 0.0))
-                emissive_zones = struct.pack('<3f', *node_values.get('EmissiveZones', (0.0, 0.0, 0.0)))
-                diffuse_wrap_global = struct.pack('<f', node_values.get('DiffuseWrapGlobal', 0.0))
-                diffuse_wrap_zones = struct.pack('<3f', *node_values.get('DiffuseWrapZones', (0.0, 0.0, 0.0)))
-                dirt_params_global = struct.pack('<f', node_values.get('DirtParamsGlobal', 0.0))
-                dirt_params_zones = struct.pack('<3f', *node_values.get('DirtParamsZones', (0.0, 0.0, 0.0)))
-                dirt_blend_global = struct.pack('<f', node_values.get('DirtBlendGlobal', 0.0))
-                dirt_blend_zones = struct.pack('<3f', *node_values.get('DirtBlendZones', (0.0, 0.0, 0.0)))
-                dirt_color = struct.pack('<4f', *color_values.get('DirtColor', (0.0, 0.0, 0.0, 0.0)))
-                decal_count_global = struct.pack('<f', node_values.get('DecalCountGlobal', 0.0))
-                decal_count_zones = struct.pack('<3f', *node_values.get('DecalCountZones', (0.0, 0.0, 0.0)))
-                decal_width_global = struct.pack('<f', node_values.get('DecalWidthGlobal', 0.0))
-                decal_width_zones = struct.pack('<3f', *node_values.get('DecalWidthZones', (0.0, 0.0, 0.0)))
-                decal_blend_global = struct.pack('<f', node_values.get('DecalBlendGlobal', 0.0))
-                decal_blend_zones = struct.pack('<3f', *node_values.get('DecalBlendZones', (0.0, 0.0, 0.0)))
-                decal1_color = struct.pack('<4f', *color_values.get('Decal1Color', (0.0, 0.0, 0.0, 0.0)))
-                decal2_color = struct.pack('<4f', *color_values.get('Decal2Color', (0.0, 0.0, 0.0, 0.0)))
-                decal3_color = struct.pack('<4f', *color_values.get('Decal3Color', (0.0, 0.0, 0.0, 0.0)))
-                decal4_color = struct.pack('<4f', *color_values.get('Decal4Color', (0.0, 0.0, 0.0, 0.0)))
-                damage_global = struct.pack('<f', node_values.get('DamageGlobal', 0.0))
-                damage_zones = struct.pack('<3f', *node_values.get('DamageZones', (0.0, 0.0, 0.0)))
-                damage_blend_global = struct.pack('<f', node_values.get('DamageBlendGlobal', 0.0))
-                damage_blend_zones = struct.pack('<3f', *node_values.get('DamageBlendZones', (0.0, 0.0, 0.0)))
-                damage_color = struct.pack('<4f', *color_values.get('DamageColor', (0.0, 0.0, 0.0, 0.0)))
-                f.write(specular_gloss_global)
-                f.write(specular_gloss_zones)
-                f.write(metallic_global)
-                f.write(metallic_zones)
-                f.write(clearcoat_global)
-                f.write(clearcoat_zones)
-                f.write(emissive_global)
-                f.write(emissive_zones)
-                f.write(diffuse_wrap_global)
-                f.write(diffuse_wrap_zones)
-                f.write(dirt_params_global)
-                f.write(dirt_params_zones)
-                f.write(dirt_blend_global)
-                f.write(dirt_blend_zones)
-                f.write(dirt_color)
-                f.write(decal_count_global)
-                f.write(decal_count_zones)
-                f.write(decal_width_global)
-                f.write(decal_width_zones)
-                f.write(decal1_color)
-                f.write(decal2_color)
-                f.write(decal3_color)
-                f.write(decal4_color)
-                f.write(decal_blend_global)
-                f.write(decal_blend_zones)
-                f.write(damage_global)
-                f.write(damage_zones)
-                f.write(damage_blend_global)
-                f.write(damage_blend_zones)
-                f.write(damage_color)
-                if boolean_values.get('SUPPORT_DECALS') == False:
-                    f.write(bytes([0x00, 0x00, 0x00, 0x00]))
-                else: 
-                    f.write(bytes([0x00, 0x00, 0x80, 0x3F]))
-                if boolean_values.get('SUPPORT_DAMAGE_BLEND') == False:
-                    f.write(bytes([0x00, 0x00, 0x00, 0x00]))
-                else: 
-                    f.write(bytes([0x00, 0x00, 0x80, 0x3F])) 
-                f.write(bytes([0x00, 0x00, 0x00, 0x00])) # support layered, always on
-                f.write(bytes([0x00] * 8)) # suport overlay and rotation, always off
-                if boolean_values.get('SUPPORT_DIRT') == False:
-                    f.write(bytes([0x00, 0x00, 0x00, 0x00]))
-                else: 
-                    f.write(bytes([0x00, 0x00, 0x80, 0x40]))
-                if boolean_values.get('SUPPORT_SOFT_TINT') == False:
-                    f.write(bytes([0x00, 0x00, 0x00, 0x00]))
-                else: 
-                    f.write(bytes([0x00, 0x00, 0x80, 0x41]))                                                            
-                f.write(bytes([0x00] * 76))
-                f.write(bytes([0x00] * 1024))
-                f.write(bytes([0x0C, 0x00, 0x00, 0x00]))
-
-                for path_length, path in obj_data['texture_paths']:
-                    f.write(struct.pack('<I', path_length))
-                    if path_length > 0:
-                        f.write(path.encode('utf-8'))
-
-                f.write(bytes([0x00] * 16))
-                f.write(struct.pack('<I', len(obj_data['vertices'])))
-
-                for v in obj_data['vertices']:
-                    f.write(struct.pack('<3f', *v))
-
-                f.write(struct.pack('<I', len(obj_data['vertices'])))
-                for u1, u2, n, t in zip(obj_data['uv1'], obj_data['uv2'], obj_data['normals'], obj_data['tangents']):
-                    f.write(struct.pack('<2f', *u1))
-                    f.write(struct.pack('<2f', *u2))
-                    f.write(struct.pack('<f', n))
-                    f.write(struct.pack('<f', t))
-
-                f.write(struct.pack('<I', len(obj_data['vertices'])))
-                for u3 in obj_data['uv3']:
-                    f.write(struct.pack('<2f', *u3))
-
-                f.write(struct.pack('<I', obj_data['face_indices_count']))
-
-                for face in obj_data['faces']:
-                    f.write(struct.pack('<3H', *face))
-
-                f.write(bytes.fromhex("EFCDAB89"))
-            
-            if obj_data['node_group_name'] == 'BAVARIUMSHIELD':
-                additional_block_start = bytes.fromhex("CD4CD2A501A5A4243EABAA2A3FAFAE2E3FCDCCCC3D010000002500000074657874757265732F64756D6D6965732F64756D6D795F616C7068615F6469662E64647363F0EE113D000080470000804700000000")
-                f.write(additional_block_start)
-
-                f.write(struct.pack('<I', len(obj_data['vertices'])))
-
-                for v, u1, n, t in zip(obj_data['vertices'], obj_data['uv1'], obj_data['normals'], obj_data['tangents']):
-                    f.write(struct.pack('<3f', *v))
-                    f.write(struct.pack('<2f', *u1))
-                    f.write(struct.pack('<f', n))
-                    f.write(struct.pack('<f', t))
-
-                f.write(struct.pack('<I', obj_data['face_indices_count']))
-
-                for face in obj_data['faces']:
-                    f.write(struct.pack('<3H', *face))
-
-                f.write(bytes.fromhex("EFCDAB89"))
-                
-            if obj_data['node_group_name'] == 'WATERHULL':
-                additional_block_start = bytes.fromhex("A1729CF90100000000D0EEF93D000080470000804700000000")
-                f.write(additional_block_start)
-
-                f.write(struct.pack('<I', len(obj_data['vertices'])))
-
-                for v in obj_data['vertices']:
-                    f.write(struct.pack('<3f', *v))
-
-                f.write(struct.pack('<I', obj_data['face_indices_count']))
-
-                for face in obj_data['faces']:
-                    f.write(struct.pack('<3H', *face))
-
-                f.write(bytes.fromhex("EFCDAB89"))
-                
-            if obj_data['node_group_name'] == 'WINDOW':
-                additional_block_start = bytes.fromhex("F603205B01")
-                f.write(additional_block_start)
-
-                node_values = obj_data['node_values']
-                specular_gloss = struct.pack('<f', node_values.get('SpecularGloss', 0.0))
-                specular_fresnel = struct.pack('<f', node_values.get('SpecularFresnel', 0.0))
-                diffuse_roughness = struct.pack('<f', node_values.get('DiffuseRoughness', 0.0))
-                tint_power = struct.pack('<f', node_values.get('TintPower', 0.0))
-                min_alpha = struct.pack('<f', node_values.get('MinAlpha', 0.0))
-                uvscale = struct.pack('<f', node_values.get('UVScale', 0.0))
-
-                f.write(specular_gloss)
-                f.write(specular_fresnel)
-                f.write(diffuse_roughness)
-                f.write(tint_power)
-                f.write(min_alpha)
-                f.write(uvscale)
-                unkownf4 = bytes.fromhex("30 80 D6 BE 9A D9 D0 3F 4C 4F 68 BE 00 00 00 00")
-                f.write(unkownf4)
-
-                f.write(bytes([0x07, 0x00, 0x00, 0x00]))
-
-                for path_length, path in obj_data['texture_paths']:
-                    f.write(struct.pack('<I', path_length))
-                    if path_length > 0:
-                        f.write(path.encode('utf-8'))
-
-                f.write(bytes([0x00] * 16))
-
-                # Debugging: Print lengths of all lists
-                print(f"Number of vertices: {len(obj_data['vertices'])}")
-                print(f"Number of UV1s: {len(obj_data['uv1'])}")
-                print(f"Number of UV2s: {len(obj_data['uv2'])}")
-                print(f"Number of normals: {len(obj_data['normals'])}")
-                print(f"Number of tangents: {len(obj_data['tangents'])}")
-                print(f"Number of color values: {len(obj_data['color_values'])}")
-
-                f.write(struct.pack('<I', len(obj_data['vertices'])))
-
-                # Assuming color_values are floats in the range 0.0 to 1.0
-                float_color_values = obj_data['color_values'].get('ColorAndAlpha', (0.0, 0.0, 0.0, 0.0))
-                int_color_values = [int(255 * value) for value in float_color_values]  # Convert float to int (0-255)
-                color = struct.pack('<4B', *int_color_values)
-
-                for v, u1, u2, n, t in zip(obj_data['vertices'], obj_data['uv1'], obj_data['uv2'], obj_data['normals'], obj_data['tangents']):
-                    f.write(struct.pack('<3f', *v))
-                    f.write(struct.pack('<2f', *u1))
-                    f.write(struct.pack('<2f', *u2))
-                    f.write(struct.pack('<f', n))
-                    f.write(struct.pack('<f', t))
-                    f.write(color)
-
-                f.write(struct.pack('<I', obj_data['face_indices_count']))
-
-                for face in obj_data['faces']:
-                    f.write(struct.pack('<3H', *face))
-
-                f.write(bytes.fromhex("EFCDAB89"))
-                
-            if obj_data['node_group_name'] == 'CARLIGHT':
-                additional_block_start = bytes.fromhex("F1 8B 94 DB 01")
-                f.write(additional_block_start)
-                
-                node_values = obj_data['node_values']
-                color_values = obj_data['color_values']
-                specular_gloss = struct.pack('<f', node_values.get('SpecularGloss', 0.0))
-                reflectivity = struct.pack('<f', node_values.get('Reflectivity', 0.0))
-                specular_fresnel = struct.pack('<f', node_values.get('SpecularFresnel', 0.0)) 
-                diffuse_modulator = struct.pack('<4f', *color_values.get('DiffuseModulator', (0.0, 0.0, 0.0, 0.0)))              
-                tilingx = struct.pack('<f', node_values.get('TilingX', 0.0))
-                tilingy = struct.pack('<f', node_values.get('TilingY', 0.0))
-                f.write(specular_gloss)
-                f.write(reflectivity)
-                f.write(specular_fresnel)
-                f.write(diffuse_modulator)
-                f.write(tilingx)
-                f.write(tilingy)
-                f.write(bytes([0x00] * 1008))
-                f.write(bytes([0x06, 0x00, 0x00, 0x00]))
-
-                for path_length, path in obj_data['texture_paths']:
-                    f.write(struct.pack('<I', path_length))
-                    if path_length > 0:
-                        f.write(path.encode('utf-8'))
-
-                f.write(bytes([0x00] * 16))
-
-                f.write(struct.pack('<I', len(obj_data['vertices'])))
-
-                for v in obj_data['vertices']:
-                    f.write(struct.pack('<3f', *v))
-
-                f.write(struct.pack('<I', len(obj_data['vertices'])))
-                for u1, u2, n, t in zip(obj_data['uv1'], obj_data['uv2'], obj_data['normals'], obj_data['tangents']):
-                    f.write(struct.pack('<2f', *u1))
-                    f.write(struct.pack('<2f', *u2))
-                    f.write(struct.pack('<f', n))
-                    f.write(struct.pack('<f', t))
-
-                f.write(struct.pack('<I', obj_data['face_indices_count']))
-
-                for face in obj_data['faces']:
-                    f.write(struct.pack('<3H', *face))
-
-                f.write(bytes.fromhex("EFCDAB89"))
-
-    print(f"Data exported to {file_path}")
+def process_object(obj, supported_nodegroups, material_cache=None, geometry_cache=None):
+    job = gather_object(obj, supported_nodegroups, material_cache, geometry_cache)
+    if job is None:
+        return None
+    return finish_object(job, geometry_cache)
+
+def build_object_blocks(obj_name, obj_data, optimize_cache=False, telemetry=None, lod=0):
+    blocks = split_into_blocks(obj_data)
+    if len(blocks) > 1:
+        log.info(f"Object {obj_name} has {len(obj_data['vertices'])} vertices, split into {len(blocks)} blocks of at most {MAX_BLOCK_VERTICES}")
+
+    if optimize_cache:
+        for i, block_data in enumerate(blocks):
+            blocks[i], before, after = optimize_vertex_cache(block_data)
+            log.info(f"Object {obj_name}, block {i}: ACMR {before['acmr']:.3f} -> {after['acmr']:.3f}, "
+                     f"ATVR {before['atvr']:.3f} -> {after['atvr']:.3f}")
+            if telemetry is not None:
+                telemetry.add_vertex_cache(obj_name, lod, i, len(blocks[i]['faces']), before, after)
+    return blocks
+
+def build_lod_variants(obj_name, obj_data, lod_levels, telemetry=None):
+    # Level 0 is the welded base mesh; every LOD decimates that same base
+    variants = [obj_data]
+    triangle_count = len(obj_data['faces'])
+    for level, lod_level in enumerate(lod_levels, start=1):
+        decimated, stats = decimate(obj_data, lod_triangle_target(triangle_count, lod_level))
+        missed = stats['triangles'] > stats['target_triangles'] * LOD_TARGET_MISS_RATIO
+        if missed:
+            log.warning(f"Object {obj_name}, LOD {level}: kept {stats['triangles']} triangles for a target of "
+                        f"{stats['target_triangles']}; the rest are held by seams, hard edges or open borders")
+        else:
+            log.info(f"Object {obj_name}, LOD {level}: {stats['source_triangles']} -> {stats['triangles']} triangles "
+                     f"(target {stats['target_triangles']}), {stats['vertices']} vertices")
+        if telemetry is not None:
+            telemetry.add_lod(obj_name, level, stats, missed)
+        variants.append(decimated)
+    return variants
+
+def pack_object(job, optimize_cache=False, geometry_cache=None, pack=False, telemetry=None, lod_levels=(),
+                instance_cache=None):
+    # Worker step: welding, LOD decimation, splitting, cache optimisation and, when
+    # streaming, the block bytes themselves. Returns (lod, RBMMesh, packed_block or None)
+    telemetry = telemetry or ExportTelemetry()
+    if 'instance_of' in job:
+        return pack_instance(job, instance_cache, pack, telemetry)
+
+    key = job.get('instance_key')
+    blocks = None
+    try:
+        with telemetry.stage('geometry', job['name']):
+            obj_data = finish_object(job, geometry_cache, telemetry)
+        with telemetry.stage('lod', job['name']):
+            variants = build_lod_variants(job['name'], obj_data, lod_levels, telemetry)
+        with telemetry.stage('blocks', job['name']):
+            meshes = [(lod, RBMMesh.from_block_data(block_data))
+                      for lod, variant in enumerate(variants)
+                      for block_data in build_object_blocks(job['name'], variant, optimize_cache, telemetry, lod)]
+        if not pack:
+            blocks = [(lod, mesh, None) for lod, mesh in meshes]
+        else:
+            with telemetry.stage('pack', job['name']):
+                blocks = [(lod, mesh, pack_block(mesh)) for lod, mesh in meshes]
+    finally:
+        if key is not None:
+            if blocks is None:
+                instance_cache.abandon(key)
+            else:
+                instance_cache.publish(key, blocks, job['material']['material_key'])
+    return blocks
+
+def pack_instance(job, instance_cache, pack=False, telemetry=None):
+    # Linked duplicate: the first object using the same mesh and modifiers has built the
+    # blocks. The exporter writes every object in its own space, so the vertex data is
+    # reused as is; only a different material means packing the blocks again
+    telemetry = telemetry or ExportTelemetry()
+    with telemetry.stage('instance', job['name']):
+        source = instance_cache.wait(job['instance_of'])
+    if source['blocks'] is None:
+        log.warning(f"Skipping {job['name']}: {source['reason']}")
+        telemetry.skip(job['name'], source['reason'])
+        return []
+
+    material_key = job['material']['material_key']
+    material = None
+    if material_key is None or material_key != source['material_key']:
+        material = RBMMaterial.from_block_data(job['material'])
+
+    blocks = []
+    with telemetry.stage('pack' if material is not None and pack else 'instance', job['name']):
+        for lod, mesh, packed_block in source['blocks']:
+            instance = copy.copy(mesh)
+            instance.name = job['name']
+            if material is not None:
+                instance.material = material
+                packed_block = pack_block(instance) if pack else None
+            blocks.append((lod, instance, packed_block))
+    return blocks
+
+def iter_object_blocks(objects, supported_nodegroups, optimize_cache=False, geometry_cache=None,
+                       workers=1, pack=False, telemetry=None, lod_levels=()):
+    # Blocks come out in selection order whatever the worker count, so the file is
+    # identical to a single-threaded export. At most `workers` objects are in flight
+    # past the one being written, which keeps streaming memory bounded
+    material_cache = {}
+    instance_cache = InstanceCache()
+    telemetry = telemetry or ExportTelemetry()
+
+    def gathered():
+        for obj in objects:
+            log.info(f"Processing object: {obj.name}")
+            with telemetry.stage('extract', obj.name):
+                job = gather_object(obj, supported_nodegroups, material_cache, geometry_cache, telemetry,
+                                    instance_cache)
+            if job is not None:
+                yield job
+
+    try:
+        if workers <= 1:
+            for job in gathered():
+                yield from pack_object(job, optimize_cache, geometry_cache, pack, telemetry, lod_levels, instance_cache)
+            return
+
+        # Instances only wait on objects submitted before them, which the pool has
+        # already started, so waiting inside a worker cannot deadlock
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for job in gathered():
+                pending.append(executor.submit(
+                    pack_object, job, optimize_cache, geometry_cache, pack, telemetry, lod_levels, instance_cache,
+                ))
+                job = None
+                while len(pending) > workers:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+    finally:
+        report_instance_cache(instance_cache, telemetry)
+
+def geometry_cache_for(file_path):
+    return GeometryCache(os.path.join(os.path.dirname(os.path.abspath(file_path)), GEOMETRY_CACHE_DIR))
+
+def report_geometry_cache(geometry_cache, telemetry=None):
+    if geometry_cache is None:
+        return
+    removed = geometry_cache.evict()
+    log.info(f"Geometry cache: {geometry_cache.hits} hits, {geometry_cache.misses} misses, {removed} entries evicted")
+    if telemetry is not None:
+        telemetry.record_cache('geometry', geometry_cache.hits, geometry_cache.misses)
+
+def report_instance_cache(instance_cache, telemetry):
+    log.info(f"Instance cache: {instance_cache.hits} objects reused blocks from {instance_cache.misses} meshes")
+    telemetry.record_cache('instance', instance_cache.hits, instance_cache.misses)
+
+def lod_path_for(file_path, level):
+    if level == 0:
+        return file_path
+    root, ext = os.path.splitext(file_path)
+    return f"{root}_lod{level}{ext}"
+
+def run_steps(steps):
+    # Drives an iter_export_* generator to the end and returns its result. The modal
+    # operator advances the same generators a few steps per timer event instead
+    while True:
+        try:
+            next(steps)
+        except StopIteration as stop:
+            return stop.value
+
+def export_streaming(file_path, objects, supported_nodegroups, optimize_cache=False, geometry_cache=None,
+                     workers=1, telemetry=None, lod_levels=()):
+    return run_steps(iter_export_streaming(
+        file_path, objects, supported_nodegroups, optimize_cache, geometry_cache, workers, telemetry, lod_levels,
+    ))
+
+def iter_export_streaming(file_path, objects, supported_nodegroups, optimize_cache=False, geometry_cache=None,
+                          workers=1, telemetry=None, lod_levels=()):
+    # One writer per LOD, all fed from a single extraction pass. Each file gets its own
+    # bounds. Yields after every written block; closing the generator early discards
+    # the unfinished files
+    log.info("Streaming data to file...")
+    telemetry = telemetry or ExportTelemetry()
+    with ExitStack() as stack:
+        writers = [stack.enter_context(RBMStreamWriter(lod_path_for(file_path, level)))
+                   for level in range(len(lod_levels) + 1)]
+        blocks = iter_object_blocks(
+            objects, supported_nodegroups, optimize_cache, geometry_cache, workers, pack=True, telemetry=telemetry,
+            lod_levels=lod_levels,
+        )
+        for lod, mesh, packed_block in blocks:
+            with telemetry.stage('write', mesh.name):
+                byte_count = writers[lod].write_block(mesh, packed_block)
+            telemetry.add_block(mesh, byte_count, lod)
+            yield
+        if writers[0].block_count == 0:
+            for lod_writer in writers:
+                lod_writer.abort()
+
+    report_geometry_cache(geometry_cache, telemetry)
+    telemetry.finish()
+    writer = writers[0]
+    if writer.block_count == 0:
+        log.warning("No valid objects to write.")
+        return None
+
+    for level, lod_writer in enumerate(writers):
+        log.info(f"LOD {level} min and max positions: {lod_writer.min_max_positions}")
+    log.info(f"Material block cache: {MATERIAL_BLOCK_CACHE.hits} hits, {MATERIAL_BLOCK_CACHE.misses} misses")
+    log.info(f"Data exported to {', '.join(lod_writer.file_path for lod_writer in writers)}")
+    return writer.min_max_positions
+
+class ExportAborted(Exception):
+    pass
+
+# Sent to a writer thread instead of the final None when the export fails
+WRITE_ABORTED = object()
+
+def group_objects(objects, split_mode):
+    # (name, objects) pairs for a multi-file export, in selection order. With
+    # 'COLLECTION' an object in several collections is written to each of their files
+    if split_mode == 'OBJECT':
+        return [(obj.name, [obj]) for obj in objects]
+    groups = {}
+    for obj in objects:
+        for collection in obj.users_collection:
+            groups.setdefault(collection.name, []).append(obj)
+    return list(groups.items())
+
+def group_path_for(file_path, group_name, used_paths=None):
+    # car.rbm + "Wheels" -> car_Wheels.rbm, with characters file systems reject replaced
+    root, ext = os.path.splitext(file_path)
+    name = re.sub(r'[\\/:*?"<>|\x00-\x1f]', '_', group_name).strip() or '_'
+    path = f"{root}_{name}{ext}"
+    if used_paths is not None:
+        suffix = 1
+        while path in used_paths:
+            suffix += 1
+            path = f"{root}_{name}_{suffix}{ext}"
+        used_paths.add(path)
+    return path
+
+def write_group_file(file_path, lod_count, block_queue, telemetry):
+    # Writer thread for one group: drains (lod, mesh, packed block) items until None.
+    # WRITE_ABORTED, or any error, discards the temp files. Returns whether files were written
+    with ExitStack() as stack:
+        writers = [stack.enter_context(RBMStreamWriter(lod_path_for(file_path, level))) for level in range(lod_count)]
+        while True:
+            item = block_queue.get()
+            if item is None:
+                break
+            if item is WRITE_ABORTED:
+                raise ExportAborted(file_path)
+            lod, mesh, packed_block = item
+            with telemetry.stage('write', mesh.name):
+                byte_count = writers[lod].write_block(mesh, packed_block)
+            telemetry.add_block(mesh, byte_count, lod)
+        if writers[0].block_count == 0:
+            for writer in writers:
+                writer.abort()
+            return False
+    return True
+
+def queue_block(block_queue, future, item):
+    # Bounded put that gives up if the writer thread has already failed
+    while True:
+        try:
+            block_queue.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            if future.done():
+                future.result()
+                raise ExportAborted("Writer thread stopped early")
+
+def abort_writer(block_queue, future):
+    # Never blocks: a writer that hasn't started is cancelled, otherwise the blocks it
+    # hasn't read yet are dropped so WRITE_ABORTED fits in the bounded queue. Only the
+    # export thread puts to the queue, so it stays below its limit once drained
+    if future.done() or future.cancel():
+        return
+    while True:
+        try:
+            block_queue.get_nowait()
+        except queue.Empty:
+            break
+    block_queue.put_nowait(WRITE_ABORTED)
+
+def export_group_files(file_path, groups, supported_nodegroups, optimize_cache=False, geometry_cache=None,
+                       workers=1, telemetry=None, lod_levels=(), write_workers=DEFAULT_WRITE_WORKERS):
+    return run_steps(iter_export_group_files(
+        file_path, groups, supported_nodegroups, optimize_cache, geometry_cache, workers, telemetry, lod_levels,
+        write_workers,
+    ))
+
+def iter_export_group_files(file_path, groups, supported_nodegroups, optimize_cache=False, geometry_cache=None,
+                            workers=1, telemetry=None, lod_levels=(), write_workers=DEFAULT_WRITE_WORKERS):
+    # One .rbm per (name, objects) group. Groups are read and packed one after another
+    # as in export_streaming, while each finished group is written by a writer thread,
+    # so writing one file overlaps packing the next. Files are renamed into place only
+    # when complete. Returns {group name: file path} for the groups that had blocks
+    telemetry = telemetry or ExportTelemetry()
+    used_paths = set()
+    submitted = []
+    with ThreadPoolExecutor(max_workers=max(1, write_workers)) as executor:
+        try:
+            for group_name, objects in groups:
+                group_path = group_path_for(file_path, group_name, used_paths)
+                log.info(f"Group {group_name}: {len(objects)} objects -> {group_path}")
+                block_queue = queue.Queue(maxsize=WRITE_QUEUE_BLOCKS)
+                future = executor.submit(write_group_file, group_path, len(lod_levels) + 1, block_queue, telemetry)
+                submitted.append((group_name, group_path, block_queue, future))
+                blocks = iter_object_blocks(
+                    objects, supported_nodegroups, optimize_cache, geometry_cache, workers, pack=True,
+                    telemetry=telemetry, lod_levels=lod_levels,
+                )
+                for block in blocks:
+                    queue_block(block_queue, future, block)
+                    yield
+                queue_block(block_queue, future, None)
+        except BaseException:
+            # Writers still waiting for blocks discard their temp files
+            for _, _, block_queue, future in submitted:
+                abort_writer(block_queue, future)
+            raise
+
+        written = {}
+        for group_name, group_path, _, future in submitted:
+            if future.result():
+                written[group_name] = group_path
+
+    report_geometry_cache(geometry_cache, telemetry)
+    telemetry.finish()
+    if not written:
+        log.warning("No valid objects to write.")
+    for group_name, group_path in written.items():
+        log.info(f"Group {group_name} exported to {group_path}")
+    return written
+
+def telemetry_path_for(file_path):
+    return os.path.splitext(file_path)[0] + TELEMETRY_SUFFIX
+
+def collect_textures(objects, supported_nodegroups, material_cache=None):
+    # Game path -> image name for every image linked to a texture slot of a supported node group
+    material_cache = {} if material_cache is None else material_cache
+    textures = {}
+    for obj in objects:
+        material = obj.active_material
+        if material is None:
+            continue
+        snapshot = get_material_snapshot(material, supported_nodegroups, material_cache)
+        if snapshot is None:
+            continue
+        for texture_name in MATERIAL_SCHEMAS[snapshot['node_group_name']]['texture_slots']:
+            image_name = snapshot['images'].get(texture_name)
+            if image_name:
+                textures.setdefault(texture_path_for(snapshot['base_path'], image_name), image_name)
+    return textures
+
+def read_image_pixels(image):
+    # (height, width, 4) uint8 RGBA with the top row first, or None for images without pixels
+    width, height = image.size
+    channels = image.channels
+    if not width or not height or not channels:
+        return None
+    pixels = np.empty(width * height * channels, dtype=np.float32)
+    image.pixels.foreach_get(pixels)
+    # Blender stores rows bottom-up
+    pixels = pixels.reshape(height, width, channels)[::-1]
+    if channels < 3:
+        pixels = np.concatenate([np.repeat(pixels[..., :1], 3, axis=2), pixels[..., 1:]], axis=2)
+    if pixels.shape[2] == 3:
+        pixels = np.concatenate([pixels, np.ones((height, width, 1), dtype=np.float32)], axis=2)
+    return (np.clip(pixels, 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)
+
+def texture_output_path(texture_root, game_path):
+    # Next to the referenced .ddsc path, but as .dds: the encoder writes plain DDS, not
+    # the game's container, so the file must not pass for a finished .ddsc
+    base_path, _ = os.path.splitext(game_path)
+    return os.path.join(texture_root, *[part for part in (base_path + TEXTURE_FILE_EXTENSION).split('/') if part])
+
+def export_textures(objects, supported_nodegroups, texture_root, texture_format='AUTO',
+                    workers=DEFAULT_TEXTURE_WORKERS, telemetry=None):
+    return run_steps(iter_export_textures(objects, supported_nodegroups, texture_root, texture_format, workers, telemetry))
+
+def iter_export_textures(objects, supported_nodegroups, texture_root, texture_format='AUTO',
+                         workers=DEFAULT_TEXTURE_WORKERS, telemetry=None):
+    # Pixels are read with bpy on this thread; encoding runs in worker processes.
+    # Textures whose pixels and format match their cached key are left untouched.
+    # Returns the number of textures written
+    telemetry = telemetry or ExportTelemetry()
+    texture_cache = TextureCache(os.path.join(texture_root, GEOMETRY_CACHE_DIR, 'textures'))
+
+    def gathered():
+        for game_path, image_name in collect_textures(objects, supported_nodegroups).items():
+            output_path = texture_output_path(texture_root, game_path)
+            with telemetry.stage('texture read'):
+                image = bpy.data.images.get(image_name)
+                pixels = read_image_pixels(image) if image is not None else None
+            if pixels is None:
+                log.warning(f"Texture {image_name}: no pixel data, not converted")
+                telemetry.skip(image_name, "texture has no pixel data")
+                continue
+            resolved_format = resolve_texture_format(pixels, texture_format)
+            key = fingerprint_arrays([pixels], extra=(TEXTURE_ENCODER_VERSION, resolved_format))
+            if texture_cache.is_current(output_path, key):
+                log.info(f"Texture {image_name}: unchanged, skipped")
+                telemetry.add_texture(output_path, os.path.getsize(output_path), encoded=False)
+                continue
+            yield image_name, output_path, key, pixels, resolved_format
+
+    def finished(image_name, output_path, key, resolved_format, result):
+        try:
+            byte_count = result()
+        except (OSError, ValueError) as e:
+            log.warning(f"Texture {image_name}: conversion failed: {e}")
+            telemetry.skip(image_name, f"texture conversion failed: {e}")
+            return 0
+        texture_cache.store(output_path, key)
+        telemetry.add_texture(output_path, byte_count, encoded=True)
+        log.info(f"Texture {image_name}: {resolved_format}, {byte_count} bytes -> {output_path}")
+        return 1
+
+    written = 0
+    with telemetry.stage('textures'):
+        if workers <= 1:
+            for image_name, output_path, key, pixels, resolved_format in gathered():
+                written += finished(image_name, output_path, key, resolved_format,
+                                    lambda: encode_texture_file(pixels, resolved_format, output_path))
+                yield
+        else:
+            # Spawned workers only import rbm_textures, never Blender itself. At most
+            # two images per worker are held in memory at once
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                pending = deque()
+                for image_name, output_path, key, pixels, resolved_format in gathered():
+                    future = executor.submit(encode_texture_file, pixels, resolved_format, output_path)
+                    pending.append((image_name, output_path, key, resolved_format, future.result))
+                    pixels = None
+                    while len(pending) > 2 * workers:
+                        written += finished(*pending.popleft())
+                    yield
+                while pending:
+                    written += finished(*pending.popleft())
+                    yield
+
+    log.info(f"Textures: {written} converted, {texture_cache.hits} unchanged; convert the .dds files to .ddsc for the game")
+    return written
+
+def texture_root_for(file_path, texture_folder=''):
+    # Texture base paths are resolved against this folder; by default the one holding the .rbm
+    if texture_folder:
+        return os.path.abspath(texture_folder)
+    return os.path.dirname(os.path.abspath(file_path))
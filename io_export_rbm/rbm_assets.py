@@ -0,0 +1,69 @@
+import os
+import bpy
+from rbm_telemetry import log
+
+# Looked up in the add-on folder in this order
+ASSET_FILES = ("assets.blend", "assets- nodegroups only.blend")
+
+def local_datablock(datablocks, name):
+    # Exact-name match on datablocks owned by this file; linked copies are ignored
+    for datablock in datablocks:
+        if datablock.name == name and datablock.library is None:
+            return datablock
+    return None
+
+class AssetIndex:
+    # Names of the node groups and objects in the add-on's asset file, read once per
+    # session and again only if the file changes. Datablocks already in bpy.data are
+    # reused, so assigning a node group never appends CARPAINTMM.001 and friends
+    def __init__(self, addon_dir):
+        self.addon_dir = addon_dir
+        self.file_path = None
+        self.mtime = None
+        self.node_groups = frozenset()
+        self.objects = frozenset()
+
+    def refresh(self):
+        for file_name in ASSET_FILES:
+            file_path = os.path.join(self.addon_dir, file_name)
+            if os.path.exists(file_path):
+                break
+        else:
+            raise FileNotFoundError(f"No asset file in {self.addon_dir} (looked for {', '.join(ASSET_FILES)})")
+
+        mtime = os.path.getmtime(file_path)
+        if file_path == self.file_path and mtime == self.mtime:
+            return
+        # Nothing is assigned to data_to, so this only reads the file's index
+        with bpy.data.libraries.load(file_path, link=False) as (data_from, data_to):
+            self.node_groups = frozenset(data_from.node_groups)
+            self.objects = frozenset(data_from.objects)
+        self.file_path = file_path
+        self.mtime = mtime
+        log.info(f"Asset index: {len(self.node_groups)} node groups, {len(self.objects)} objects in {file_path}")
+
+    def load(self, attribute, name):
+        # Append just this one datablock
+        self.refresh()
+        if name not in getattr(self, attribute):
+            raise KeyError(f"'{name}' is not in {os.path.basename(self.file_path)}")
+        with bpy.data.libraries.load(self.file_path, link=False) as (data_from, data_to):
+            setattr(data_to, attribute, [name])
+        datablock = getattr(data_to, attribute)[0]
+        if datablock is None:
+            raise KeyError(f"'{name}' could not be loaded from {os.path.basename(self.file_path)}")
+        log.info(f"Appended {name} from {os.path.basename(self.file_path)}")
+        return datablock
+
+    def node_group(self, name):
+        # Returns (node group, whether it was appended)
+        node_group = local_datablock(bpy.data.node_groups, name)
+        if node_group is not None:
+            return node_group, False
+        return self.load('node_groups', name), True
+
+    def object(self, name):
+        obj = local_datablock(bpy.data.objects, name)
+        if obj is not None:
+            return obj, False
+        return self.load('objects', name), True
@@ -0,0 +1,191 @@
+import hashlib
+import os
+import threading
+import numpy as np
+
+GEOMETRY_ARRAYS = ('vertices', 'uv1', 'uv2', 'uv3', 'normals', 'tangents', 'faces')
+STATS_PREFIX = 'weld_stats_'
+
+def fingerprint_arrays(arrays, extra=()):
+    digest = hashlib.sha1()
+    for item in extra:
+        digest.update(repr(item).encode('utf-8'))
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(repr((array.dtype.str, array.shape)).encode('utf-8'))
+        digest.update(array.data)
+    return digest.hexdigest()
+
+class GeometryCache:
+    # Extracted geometry stored as one .npz file per fingerprint. Files are touched on
+    # every hit, and evict() removes the least recently used ones above max_bytes.
+    def __init__(self, cache_dir, max_bytes=512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def load(self, key):
+        path = self.path_for(key)
+        try:
+            with np.load(path) as data:
+                geometry = {name: data[name] for name in GEOMETRY_ARRAYS}
+                geometry['weld_stats'] = {
+                    name[len(STATS_PREFIX):]: int(data[name]) for name in data.files if name.startswith(STATS_PREFIX)
+                }
+        except (OSError, KeyError, ValueError):
+            # Missing or unreadable entries are rebuilt
+            self.misses += 1
+            return None
+        os.utime(path)
+        self.hits += 1
+        return geometry
+
+    def store(self, key, geometry):
+        arrays = {name: geometry[name] for name in GEOMETRY_ARRAYS}
+        for name, value in geometry.get('weld_stats', {}).items():
+            arrays[STATS_PREFIX + name] = np.array(value)
+        path = self.path_for(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(temp_path, path)
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.npz'):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.cache_dir, name))
+            total -= size
+            removed += 1
+        return removed
+
+class TextureCache:
+    # Content key of every texture written by the exporter, one small file per output
+    # path. A texture is skipped when its key is unchanged and the file still exists
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path_for(self, output_path):
+        name = hashlib.sha1(os.path.abspath(output_path).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f"{name}.key")
+
+    def is_current(self, output_path, key):
+        try:
+            with open(self.path_for(output_path), "r", encoding="utf-8") as f:
+                current = f.read() == key and os.path.exists(output_path)
+        except OSError:
+            current = False
+        if current:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return current
+
+    def store(self, output_path, key):
+        path = self.path_for(output_path)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(key)
+        os.replace(temp_path, path)
+
+class InstanceCache:
+    # Blocks built for one mesh datablock during a single export, shared by every object
+    # that uses the mesh with the same modifiers. The first such object claims the key
+    # and publishes its blocks; later instances wait for them instead of extracting again
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def claim(self, key, object_name):
+        # True when the caller is the first user of key and must publish() or abandon() it
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                return False
+            self.entries[key] = {'ready': threading.Event(), 'source': object_name, 'blocks': None, 'material_key': None,
+                                 'reason': None}
+            self.misses += 1
+            return True
+
+    def source(self, key):
+        return self.entries[key]['source']
+
+    def publish(self, key, blocks, material_key):
+        entry = self.entries[key]
+        entry['blocks'] = blocks
+        entry['material_key'] = material_key
+        entry['ready'].set()
+
+    def abandon(self, key, reason="no mesh data"):
+        # Wakes waiting instances with no blocks when the first object could not be built
+        entry = self.entries[key]
+        entry['reason'] = reason
+        entry['ready'].set()
+
+    def wait(self, key):
+        entry = self.entries[key]
+        entry['ready'].wait()
+        return entry
+
+def hashable_value(prop, value):
+    # Property values as InstanceCache key parts. Enum-flag properties such as Decimate's
+    # delimit come back as sets and arrays as bpy_prop_array. Raises TypeError for
+    # anything that is still unhashable
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(value))
+    if getattr(prop, 'is_array', False):
+        value = tuple(value)
+    hash(value)
+    return value
+
+def modifier_state(obj):
+    # Evaluated geometry depends on the object's modifier stack as well as its mesh.
+    # Returns None for stacks that reference other objects or run geometry nodes, whose
+    # result can differ between objects sharing a mesh, and for property values that
+    # can't be part of a key; those objects are always extracted
+    state = []
+    for modifier in obj.modifiers:
+        if modifier.type == 'NODES':
+            return None
+        values = []
+        for prop in modifier.bl_rna.properties:
+            if prop.identifier == 'rna_type' or prop.type == 'COLLECTION':
+                continue
+            value = getattr(modifier, prop.identifier)
+            if prop.type == 'POINTER':
+                if value is not None:
+                    return None
+                continue
+            try:
+                values.append((prop.identifier, hashable_value(prop, value)))
+            except TypeError:
+                return None
+        state.append((modifier.type, tuple(values)))
+    return tuple(state)
+
+def instance_key(obj):
+    # Objects with equal keys evaluate to the same mesh in object space
+    if obj.data is None:
+        return None
+    state = modifier_state(obj)
+    if state is None:
+        return None
+    return (obj.data.as_pointer(), obj.show_only_shape_key, obj.active_shape_key_index, state)
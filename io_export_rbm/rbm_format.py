@@ -0,0 +1,450 @@
+import io
+import math
+import os
+import struct
+import threading
+from collections import OrderedDict
+import numpy as np
+from rbm_model import RBMMaterial, RBMModel, as_mesh
+from rbm_telemetry import log
+
+def compress_normal(vec):
+    x = math.floor((vec.x + 1.0) * 127.0) / 256.0
+    y = math.floor((vec.y + 1.0) * 127.0)
+    z = math.floor((vec.z + 1.0) * 127.0) * 256.0
+    return x + y + z
+
+def compress_normals(vectors, signs=None):
+    # Same quantisation as compress_normal for an (N, 3) array, done in float64 so
+    # the result rounds to float32 exactly like struct.pack('<f', compress_normal(v))
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, 3).astype(np.float64)
+    x = np.floor((vectors[:, 0] + 1.0) * 127.0) / 256.0
+    y = np.floor((vectors[:, 1] + 1.0) * 127.0)
+    z = np.floor((vectors[:, 2] + 1.0) * 127.0) * 256.0
+    packed = x + y + z
+    if signs is not None:
+        packed = np.copysign(packed, np.asarray(signs, dtype=np.float64))
+    return packed.astype(np.float32)
+
+VERTEX_ATTRIBUTE_TYPES = {
+    'vertices': ('<f4', (3,)),
+    'uv1': ('<f4', (2,)),
+    'uv2': ('<f4', (2,)),
+    'uv3': ('<f4', (2,)),
+    'normals': '<f4',
+    'tangents': '<f4',
+    'color': ('u1', (4,)),
+}
+
+# Interleaved vertex streams written for each node group, in file order
+VERTEX_STREAMS = {
+    'CARPAINTMM': [
+        ('vertices',),
+        ('uv1', 'uv2', 'normals', 'tangents'),
+        ('uv3',),
+    ],
+    'BAVARIUMSHIELD': [
+        ('vertices', 'uv1', 'normals', 'tangents'),
+    ],
+    'WATERHULL': [
+        ('vertices',),
+    ],
+    'WINDOW': [
+        ('vertices', 'uv1', 'uv2', 'normals', 'tangents', 'color'),
+    ],
+    'CARLIGHT': [
+        ('vertices',),
+        ('uv1', 'uv2', 'normals', 'tangents'),
+    ],
+}
+
+def pack_vertex_stream(attributes, names, vertex_count):
+    stream = np.empty(vertex_count, dtype=[(name, VERTEX_ATTRIBUTE_TYPES[name]) for name in names])
+    for name in names:
+        stream[name] = attributes[name]
+    return struct.pack('<I', vertex_count) + stream.tobytes()
+
+def pack_indices(faces):
+    indices = np.asarray(faces).reshape(-1)
+    if len(indices) and (indices.min() < 0 or indices.max() > 0xFFFF):
+        raise ValueError(f"Vertex index {int(indices.max())} does not fit in a 16-bit index buffer")
+    return struct.pack('<I', len(indices)) + indices.astype('<u2').tobytes()
+
+BLOCK_TERMINATOR = bytes.fromhex("EFCDAB89")
+
+ZONES_DEFAULT = (0.0, 0.0, 0.0)
+COLOR_DEFAULT = (0.0, 0.0, 0.0, 0.0)
+
+# Material block layout per node group. Each field is (kind, name, format, default):
+#   'flags'   - the calculated flags value of the object
+#   'value'   - a VALUE/VECTOR input of the node group
+#   'color'   - an RGBA input of the node group
+#   'toggle'  - a BOOLEAN input, written as 0.0 when it is off and the default otherwise
+#   'fixed'   - a constant written as is
+#   'padding' - zero bytes
+# The texture table (texture_slots, then fixed_textures) follows the fields, then the trailer.
+MATERIAL_SCHEMAS = {
+    'CARPAINTMM': {
+        'magic': bytes.fromhex("D6043348"),
+        'version': 14,
+        'fields': [
+            ('flags', 'flags_value', 'I', 0),
+            ('fixed', 'Unknown', 'f', 1.0),
+            ('value', 'SpecularGlossGlobal', 'f', 0.0),
+            ('value', 'SpecularGlossZones', '3f', ZONES_DEFAULT),
+            ('value', 'MetallicGlobal', 'f', 0.0),
+            ('value', 'MetallicZones', '3f', ZONES_DEFAULT),
+            ('value', 'ClearCoatGlobal', 'f', 0.0),
+            ('value', 'ClearCoatZones', '3f', ZONES_DEFAULT),
+            ('value', 'EmissiveGlobal', 'f', 0.0),
+            ('value', 'EmissiveZones', '3f', ZONES_DEFAULT),
+            ('value', 'DiffuseWrapGlobal', 'f', 0.0),
+            ('value', 'DiffuseWrapZones', '3f', ZONES_DEFAULT),
+            ('value', 'DirtParamsGlobal', 'f', 0.0),
+            ('value', 'DirtParamsZones', '3f', ZONES_DEFAULT),
+            ('value', 'DirtBlendGlobal', 'f', 0.0),
+            ('value', 'DirtBlendZones', '3f', ZONES_DEFAULT),
+            ('color', 'DirtColor', '4f', COLOR_DEFAULT),
+            ('value', 'DecalCountGlobal', 'f', 0.0),
+            ('value', 'DecalCountZones', '3f', ZONES_DEFAULT),
+            ('value', 'DecalWidthGlobal', 'f', 0.0),
+            ('value', 'DecalWidthZones', '3f', ZONES_DEFAULT),
+            ('color', 'Decal1Color', '4f', COLOR_DEFAULT),
+            ('color', 'Decal2Color', '4f', COLOR_DEFAULT),
+            ('color', 'Decal3Color', '4f', COLOR_DEFAULT),
+            ('color', 'Decal4Color', '4f', COLOR_DEFAULT),
+            ('value', 'DecalBlendGlobal', 'f', 0.0),
+            ('value', 'DecalBlendZones', '3f', ZONES_DEFAULT),
+            ('value', 'DamageGlobal', 'f', 0.0),
+            ('value', 'DamageZones', '3f', ZONES_DEFAULT),
+            ('value', 'DamageBlendGlobal', 'f', 0.0),
+            ('value', 'DamageBlendZones', '3f', ZONES_DEFAULT),
+            ('color', 'DamageColor', '4f', COLOR_DEFAULT),
+            ('toggle', 'SUPPORT_DECALS', 'f', 1.0),
+            ('toggle', 'SUPPORT_DAMAGE_BLEND', 'f', 1.0),
+            ('padding', 'SUPPORT_LAYERED', '4x', None), # support layered, always on
+            ('padding', 'SUPPORT_OVERLAY', '8x', None), # suport overlay and rotation, always off
+            ('toggle', 'SUPPORT_DIRT', 'f', 4.0),
+            ('toggle', 'SUPPORT_SOFT_TINT', 'f', 16.0),
+            ('padding', 'Unused', '1100x', None),
+        ],
+        'texture_slots': [
+            'DiffuseMap', 'NormalMap', 'PropertyMap', 'TintMap', 'DamageNormalMap',
+            'DamageAlbedoMap', 'DirtMap', 'DecalAlbedoMap', 'DecalNormalMap',
+            'DecalPropertyMap', 'LayeredAlbedoMap', 'OverlayAlbedoMap'
+        ],
+        'fixed_textures': [],
+        'trailer': bytes(16),
+    },
+    'BAVARIUMSHIELD': {
+        'magic': bytes.fromhex("CD4CD2A5"),
+        'version': 1,
+        'fields': [
+            ('fixed', 'Unknown', '16s', bytes.fromhex("A5A4243EABAA2A3FAFAE2E3FCDCCCC3D")),
+        ],
+        'texture_slots': [],
+        'fixed_textures': ['textures/dummies/dummy_alpha_dif.ddsc'],
+        'trailer': bytes.fromhex("F0EE113D000080470000804700000000"),
+    },
+    'WATERHULL': {
+        'magic': bytes.fromhex("A1729CF9"),
+        'version': 1,
+        'fields': [],
+        'texture_slots': [],
+        'fixed_textures': [],
+        'trailer': bytes.fromhex("D0EEF93D000080470000804700000000"),
+    },
+    'WINDOW': {
+        'magic': bytes.fromhex("F603205B"),
+        'version': 1,
+        'fields': [
+            ('value', 'SpecularGloss', 'f', 0.0),
+            ('value', 'SpecularFresnel', 'f', 0.0),
+            ('value', 'DiffuseRoughness', 'f', 0.0),
+            ('value', 'TintPower', 'f', 0.0),
+            ('value', 'MinAlpha', 'f', 0.0),
+            ('value', 'UVScale', 'f', 0.0),
+            ('fixed', 'Unknown', '16s', bytes.fromhex("3080D6BE9AD9D03F4C4F68BE00000000")),
+        ],
+        'texture_slots': [
+            'DiffuseMap', 'NormalMap', 'PropertyMap', 'DamagePointNormal',
+            'DamagePointProperty', 'DamageTileNormal', 'DamageTileProperty'
+        ],
+        'fixed_textures': [],
+        'trailer': bytes(16),
+    },
+    'CARLIGHT': {
+        'magic': bytes.fromhex("F18B94DB"),
+        'version': 1,
+        'fields': [
+            ('value', 'SpecularGloss', 'f', 0.0),
+            ('value', 'Reflectivity', 'f', 0.0),
+            ('value', 'SpecularFresnel', 'f', 0.0),
+            ('color', 'DiffuseModulator', '4f', COLOR_DEFAULT),
+            ('value', 'TilingX', 'f', 0.0),
+            ('value', 'TilingY', 'f', 0.0),
+            ('padding', 'Unused', '1008x', None),
+        ],
+        'texture_slots': [
+            'DiffuseMap', 'NormalMap', 'PropertyMap', 'UNKNOWN', 'NormalDetailMap',
+            'EmmisiveMap'
+        ],
+        'fixed_textures': [],
+        'trailer': bytes(16),
+    },
+}
+
+def compile_material_schema(node_group_name, schema):
+    if len(schema['magic']) != 4:
+        raise ValueError(f"{node_group_name}: magic must be 4 bytes, got {len(schema['magic'])}")
+    if len(schema['trailer']) != 16:
+        raise ValueError(f"{node_group_name}: trailer must be 16 bytes, got {len(schema['trailer'])}")
+
+    fmt = '<4sB'
+    fields = []
+    for kind, name, field_fmt, default in schema['fields']:
+        field_struct = struct.Struct('<' + field_fmt)
+        if kind == 'padding':
+            if not field_fmt.endswith('x'):
+                raise ValueError(f"{node_group_name}: padding field {name} must use an 'x' format")
+        else:
+            arg_count = len(field_struct.unpack(bytes(field_struct.size)))
+            if kind == 'fixed' and field_fmt.endswith('s') and len(default) != field_struct.size:
+                raise ValueError(f"{node_group_name}: fixed field {name} must be {field_struct.size} bytes")
+            fields.append((kind, name, arg_count, default))
+        fmt += field_fmt
+    fmt += 'I'
+
+    texture_count = len(schema['texture_slots']) + len(schema['fixed_textures'])
+    header_struct = struct.Struct(fmt)
+    # Pack the defaults once so a broken schema fails at import time
+    compiled = dict(schema, node_group_name=node_group_name, struct=header_struct,
+                    compiled_fields=fields, texture_count=texture_count)
+    pack_material_header(compiled, RBMMaterial(node_group_name))
+    return compiled
+
+def pack_material_header(schema, material):
+    values = [schema['magic'], schema['version']]
+    for kind, name, arg_count, default in schema['compiled_fields']:
+        if kind == 'flags':
+            value = getattr(material, name)
+        elif kind == 'value':
+            value = material.node_values.get(name, default)
+        elif kind == 'color':
+            value = material.color_values.get(name, default)
+        elif kind == 'toggle':
+            value = 0.0 if material.boolean_values.get(name) == False else default
+        else:
+            value = default
+        if arg_count == 1:
+            values.append(value)
+        else:
+            values.extend(value)
+    values.append(schema['texture_count'])
+    return schema['struct'].pack(*values)
+
+def pack_texture_table(texture_paths):
+    table = bytearray()
+    for path_length, path in texture_paths:
+        table += struct.pack('<I', path_length)
+        if path_length > 0:
+            table += path.encode('utf-8')
+    return bytes(table)
+
+def pack_material_block(material):
+    schema = COMPILED_MATERIAL_SCHEMAS[material.node_group_name]
+    if len(material.texture_paths) != len(schema['texture_slots']):
+        raise ValueError(f"{schema['node_group_name']} expects {len(schema['texture_slots'])} texture paths, got {len(material.texture_paths)}")
+    texture_paths = list(material.texture_paths)
+    texture_paths += [(len(path.encode('utf-8')), path) for path in schema['fixed_textures']]
+    return pack_material_header(schema, material) + pack_texture_table(texture_paths) + schema['trailer']
+
+COMPILED_MATERIAL_SCHEMAS = {
+    name: compile_material_schema(name, schema) for name, schema in MATERIAL_SCHEMAS.items()
+}
+
+if len({schema['magic'] for schema in MATERIAL_SCHEMAS.values()}) != len(MATERIAL_SCHEMAS):
+    raise ValueError("Material schemas must have unique magic bytes")
+
+class MaterialBlockCache:
+    # LRU cache of serialised material blocks. Keys come from the material's content
+    # hash, so a changed input simply misses and the stale entry ages out. Blocks are
+    # packed from worker threads, so lookups and updates are serialised by a lock
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, material):
+        if material.material_key is None:
+            return pack_material_block(material)
+
+        key = (material.node_group_name, material.material_key)
+        with self.lock:
+            block = self.entries.get(key)
+            if block is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return block
+            self.misses += 1
+
+        block = pack_material_block(material)
+        with self.lock:
+            self.entries[key] = block
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return block
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+MATERIAL_BLOCK_CACHE = MaterialBlockCache()
+
+FILE_HEADER = bytes.fromhex("0500000052424D444C010000001000000000000000")
+BOUNDS_OFFSET = len(FILE_HEADER)
+BOUNDS_AND_COUNT_STRUCT = struct.Struct('<6fI')
+
+def pack_file_header(min_max_positions, block_count):
+    return FILE_HEADER + BOUNDS_AND_COUNT_STRUCT.pack(*min_max_positions, block_count) + struct.pack('<I', 8)
+
+def window_color(material):
+    # Assuming color_values are floats in the range 0.0 to 1.0
+    float_color_values = material.color_values.get('ColorAndAlpha', (0.0, 0.0, 0.0, 0.0))
+    int_color_values = [int(255 * value) for value in float_color_values]  # Convert float to int (0-255)
+    return np.frombuffer(struct.pack('<4B', *int_color_values), dtype=np.uint8)
+
+def write_geometry(f, mesh, color=None):
+    attributes = mesh.attributes()
+    attributes['color'] = color
+    for names in VERTEX_STREAMS[mesh.material.node_group_name]:
+        f.write(pack_vertex_stream(attributes, names, mesh.vertex_count))
+    f.write(pack_indices(mesh.indices))
+
+def write_block(f, mesh):
+    # Blocks are RBMMesh objects; dicts from the exporter's mesh utilities are converted
+    mesh = as_mesh(mesh)
+    log.debug(f"Writing {mesh.material.node_group_name} block: {mesh.vertex_count} vertices, "
+              f"{mesh.triangle_count} triangles")
+
+    f.write(MATERIAL_BLOCK_CACHE.get(mesh.material))
+
+    color = None
+    if mesh.material.node_group_name == 'WINDOW':
+        color = window_color(mesh.material)
+
+    write_geometry(f, mesh, color=color)
+    f.write(BLOCK_TERMINATOR)
+
+def pack_block(mesh):
+    # Serialise a whole block to bytes so it can be built off the writing thread
+    buffer = io.BytesIO()
+    write_block(buffer, mesh)
+    return buffer.getvalue()
+
+def calculate_global_min_max(objects_data):
+    return RBMModel(objects_data).min_max_positions()
+
+def temp_path_for(file_path):
+    # Files are written next to their destination and renamed into place when complete,
+    # so a failed or cancelled export never leaves a truncated .rbm behind
+    return f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+def write_to_file(file_path, objects_data, min_max_positions, telemetry=None, lod=0):
+    log.info("Writing data to file...")
+    temp_path = temp_path_for(file_path)
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(pack_file_header(min_max_positions, len(objects_data)))
+
+            for obj_data in objects_data:
+                mesh = as_mesh(obj_data)
+                start = f.tell()
+                write_block(f, mesh)
+                if telemetry is not None:
+                    telemetry.add_block(mesh, f.tell() - start, lod)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    log.info(f"Material block cache: {MATERIAL_BLOCK_CACHE.hits} hits, {MATERIAL_BLOCK_CACHE.misses} misses")
+    log.info(f"Data exported to {file_path}")
+
+def write_model(file_path, model, telemetry=None, lod=0):
+    write_to_file(file_path, model.meshes, model.min_max_positions(), telemetry, lod)
+
+class RBMStreamWriter:
+    # Writes blocks as they arrive and back-patches the bounds and block count on close,
+    # so only one object's data has to be held in memory at a time. The file only
+    # appears at file_path once close() has finished it
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.temp_path = temp_path_for(file_path)
+        self.block_count = 0
+        self.bounds_min = None
+        self.bounds_max = None
+        self.f = open(self.temp_path, "wb")
+        self.f.write(pack_file_header((0.0,) * 6, 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    @property
+    def min_max_positions(self):
+        if self.bounds_min is None:
+            return (0.0,) * 6
+        return tuple(self.bounds_min.tolist() + self.bounds_max.tolist())
+
+    def write_block(self, mesh, packed_block=None):
+        # Returns the number of bytes the block took in the file
+        mesh = as_mesh(mesh)
+        start = self.f.tell()
+        if packed_block is None:
+            write_block(self.f, mesh)
+        else:
+            self.f.write(packed_block)
+        self.block_count += 1
+
+        bounds = mesh.bounds()
+        if bounds is not None:
+            block_min, block_max = bounds
+            if self.bounds_min is None:
+                self.bounds_min, self.bounds_max = block_min, block_max
+            else:
+                self.bounds_min = np.minimum(self.bounds_min, block_min)
+                self.bounds_max = np.maximum(self.bounds_max, block_max)
+        return self.f.tell() - start
+
+    def close(self):
+        if self.f is None:
+            return
+        try:
+            self.f.seek(BOUNDS_OFFSET)
+            self.f.write(BOUNDS_AND_COUNT_STRUCT.pack(*self.min_max_positions, self.block_count))
+            self.f.close()
+            self.f = None
+            os.replace(self.temp_path, self.file_path)
+        except BaseException:
+            self.abort()
+            raise
+
+    def abort(self):
+        # Safe to call more than once, and after a failed close
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
@@ -0,0 +1,591 @@
+import numpy as np
+from rbm_format import VERTEX_ATTRIBUTE_TYPES, compress_normals
+
+VERTEX_ATTRIBUTES = ('vertices', 'uv1', 'uv2', 'uv3', 'normals', 'tangents')
+
+# Per-vertex attributes that decide whether two loops can share a vertex
+WELD_ATTRIBUTES = VERTEX_ATTRIBUTES
+
+FNV_OFFSET = np.uint64(0xCBF29CE484222325)
+FNV_PRIME = np.uint64(0x100000001B3)
+
+def unique_keys(keys):
+    # Hash each fixed-size key to 64 bits and deduplicate the hashes, which is much
+    # faster than sorting the raw bytes. Collisions are detected by comparing every key
+    # with its group representative, falling back to an exact byte-wise unique.
+    words = keys.view(np.uint32).reshape(len(keys), keys.dtype.itemsize // 4)
+    hashes = np.full(len(keys), FNV_OFFSET, dtype=np.uint64)
+    for column in words.T:
+        hashes ^= column
+        hashes *= FNV_PRIME
+    _, first_keys, key_to_unique = np.unique(hashes, return_index=True, return_inverse=True)
+    key_to_unique = key_to_unique.reshape(-1)
+    if np.array_equal(words, words[first_keys[key_to_unique]]):
+        return first_keys, key_to_unique
+
+    key_bytes = keys.view(np.dtype((np.void, keys.dtype.itemsize)))
+    _, first_keys, key_to_unique = np.unique(key_bytes, return_index=True, return_inverse=True)
+    return first_keys, key_to_unique.reshape(-1)
+
+def weld_vertices(loop_attributes, loop_vertex_indices, triangle_loops):
+    # Every loop becomes a candidate vertex keyed by its exported attributes. Loops with
+    # identical keys share one vertex, so UV seams and hard edges split and coincident
+    # duplicates weld. Vertices keep the order in which their first loop appears.
+    loop_count = len(loop_vertex_indices)
+    key_dtype = np.dtype([(name, VERTEX_ATTRIBUTE_TYPES[name]) for name in WELD_ATTRIBUTES])
+    keys = np.empty(loop_count, dtype=key_dtype)
+    for name in WELD_ATTRIBUTES:
+        keys[name] = loop_attributes[name]
+
+    first_loops, loop_to_unique = unique_keys(keys)
+
+    order = np.argsort(first_loops, kind='stable')
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    loop_to_vertex = rank[loop_to_unique]
+    vertex_loops = first_loops[order]
+
+    vertex_attributes = {
+        name: np.ascontiguousarray(loop_attributes[name][vertex_loops]) for name in WELD_ATTRIBUTES
+    }
+    faces = loop_to_vertex[np.asarray(triangle_loops).reshape(-1, 3)]
+
+    vertex_count = len(vertex_loops)
+    pairs = np.unique(np.asarray(loop_vertex_indices, dtype=np.int64) * max(vertex_count, 1) + loop_to_vertex)
+    source_vertices = len(np.unique(pairs // max(vertex_count, 1)))
+    stats = {
+        'loops': loop_count,
+        'source_vertices': source_vertices,
+        'vertices': vertex_count,
+        'splits': len(pairs) - source_vertices,
+        'welds': len(pairs) - vertex_count,
+    }
+    return vertex_attributes, faces, stats
+
+def build_geometry(mesh_arrays):
+    # Per-loop arrays from extract_mesh_arrays -> welded per-vertex attributes and faces
+    loop_vertex_indices = mesh_arrays['loop_vertex_indices']
+    loop_count = len(loop_vertex_indices)
+
+    loop_attributes = {
+        'vertices': mesh_arrays['vertices'][loop_vertex_indices],
+        'normals': compress_normals(mesh_arrays['normals']),
+        'tangents': compress_normals(mesh_arrays['tangents'], mesh_arrays['bitangent_signs']),
+    }
+    uv_layers = mesh_arrays['uv_layers']
+    for i, name in enumerate(('uv1', 'uv2', 'uv3')):
+        uv = np.zeros((loop_count, 2), dtype=np.float32)
+        if i < len(uv_layers):
+            uv[:, 0] = uv_layers[i][:, 0]
+            uv[:, 1] = -uv_layers[i][:, 1]
+        loop_attributes[name] = uv
+
+    vertex_attributes, faces, weld_stats = weld_vertices(
+        loop_attributes, loop_vertex_indices, mesh_arrays['triangle_loops'],
+    )
+    geometry = dict(vertex_attributes, faces=faces, weld_stats=weld_stats)
+    return geometry
+
+def fallback_tangents(normals):
+    # Any unit vector perpendicular to the normal, for loops without usable UVs
+    axis = np.zeros_like(normals)
+    use_y = np.abs(normals[:, 0]) > 0.9
+    axis[~use_y, 0] = 1.0
+    axis[use_y, 1] = 1.0
+    tangents = axis - normals * np.einsum('ij,ij->i', normals, axis)[:, None]
+    return tangents / np.maximum(np.linalg.norm(tangents, axis=1, keepdims=True), 1e-12)
+
+def loop_tangents(positions, loop_vertex_indices, triangle_loops, normals, uv=None):
+    # Per-loop tangents and bitangent signs, used when Blender's calc_tangents is not
+    # available for a mesh. Like MikkTSpace, each triangle's UV tangent is weighted by
+    # the corner angle and summed over loops that share a vertex, normal and UV, so the
+    # result does not depend on how faces are triangulated; the sum is then made
+    # orthogonal to the loop normal. Linear in the loop count and float32 throughout.
+    normals = np.asarray(normals, dtype=np.float32).reshape(-1, 3)
+    normals = normals / np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), 1e-12)
+    loop_count = len(normals)
+    if uv is None:
+        return fallback_tangents(normals), np.ones(loop_count, dtype=np.float32)
+
+    triangle_loops = np.asarray(triangle_loops).reshape(-1, 3)
+    uv = np.asarray(uv, dtype=np.float32).reshape(-1, 2)
+    positions = np.asarray(positions, dtype=np.float32)
+    triangle_vertices = np.asarray(loop_vertex_indices)[triangle_loops]
+    corner0 = positions[triangle_vertices[:, 0]]
+    edge1 = positions[triangle_vertices[:, 1]] - corner0
+    edge2 = positions[triangle_vertices[:, 2]] - corner0
+    corner0 = None
+    uv0 = uv[triangle_loops[:, 0]]
+    delta1 = uv[triangle_loops[:, 1]] - uv0
+    delta2 = uv[triangle_loops[:, 2]] - uv0
+    uv0 = None
+
+    # Only the direction matters, so the UV determinant is reduced to its sign;
+    # triangles with degenerate UVs contribute nothing
+    determinant = delta1[:, 0] * delta2[:, 1] - delta2[:, 0] * delta1[:, 1]
+    orientation = np.where(np.abs(determinant) > 1e-20, np.sign(determinant), 0.0).astype(np.float32)[:, None]
+    face_tangents = (edge1 * delta2[:, 1:2] - edge2 * delta1[:, 1:2]) * orientation
+    face_tangents /= np.maximum(np.linalg.norm(face_tangents, axis=1, keepdims=True), 1e-30)
+    face_bitangents = (edge2 * delta1[:, 0:1] - edge1 * delta2[:, 0:1]) * orientation
+    face_bitangents /= np.maximum(np.linalg.norm(face_bitangents, axis=1, keepdims=True), 1e-30)
+
+    # Corner angles, the third from the other two
+    edge12 = edge2 - edge1
+    edge1 /= np.maximum(np.linalg.norm(edge1, axis=1, keepdims=True), 1e-30)
+    edge2 /= np.maximum(np.linalg.norm(edge2, axis=1, keepdims=True), 1e-30)
+    edge12 /= np.maximum(np.linalg.norm(edge12, axis=1, keepdims=True), 1e-30)
+    angles = np.empty(triangle_loops.shape, dtype=np.float32)
+    angles[:, 0] = np.arccos(np.clip(np.einsum('ij,ij->i', edge1, edge2), -1.0, 1.0))
+    angles[:, 1] = np.arccos(np.clip(-np.einsum('ij,ij->i', edge1, edge12), -1.0, 1.0))
+    angles[:, 2] = np.pi - angles[:, 0] - angles[:, 1]
+    edge1 = edge2 = edge12 = None
+
+    # Loops that share a vertex, normal and UV end up with one tangent
+    key_dtype = np.dtype([('vertex', '<i4'), ('normal', '<f4', (3,)), ('uv', '<f4', (2,))])
+    keys = np.empty(loop_count, dtype=key_dtype)
+    keys['vertex'] = loop_vertex_indices
+    keys['normal'] = normals
+    keys['uv'] = uv
+    _, loop_groups = unique_keys(keys)
+    keys = None
+    group_count = int(loop_groups.max()) + 1 if loop_count else 0
+
+    corner_groups = loop_groups[triangle_loops].reshape(-1)
+    angles = angles.reshape(-1, 3)
+    summed_tangents = np.empty((group_count, 3), dtype=np.float32)
+    summed_bitangents = np.empty((group_count, 3), dtype=np.float32)
+    for axis in range(3):
+        summed_tangents[:, axis] = np.bincount(
+            corner_groups, weights=(angles * face_tangents[:, axis:axis + 1]).reshape(-1), minlength=group_count)
+        summed_bitangents[:, axis] = np.bincount(
+            corner_groups, weights=(angles * face_bitangents[:, axis:axis + 1]).reshape(-1), minlength=group_count)
+    corner_groups = face_tangents = face_bitangents = None
+
+    tangents = summed_tangents[loop_groups]
+    tangents -= normals * np.einsum('ij,ij->i', normals, tangents)[:, None]
+    lengths = np.linalg.norm(tangents, axis=1, keepdims=True)
+    degenerate = lengths[:, 0] < 1e-12
+    tangents /= np.maximum(lengths, 1e-30)
+    tangents[degenerate] = fallback_tangents(normals[degenerate])
+
+    # Same convention as Blender: bitangent = sign * cross(normal, tangent)
+    handedness = np.einsum('ij,ij->i', np.cross(normals, tangents), summed_bitangents[loop_groups])
+    signs = np.where(handedness < 0.0, -1.0, 1.0).astype(np.float32)
+    return tangents, signs
+
+# Faces are written as uint16 indices, so a block can address at most this many vertices
+MAX_BLOCK_VERTICES = 0xFFFF
+
+def part_bits(values):
+    # Spread the low 10 bits of each value so two zero bits sit between them
+    values = values.astype(np.uint32) & 0x3FF
+    values = (values | (values << 16)) & 0x030000FF
+    values = (values | (values << 8)) & 0x0300F00F
+    values = (values | (values << 4)) & 0x030C30C3
+    values = (values | (values << 2)) & 0x09249249
+    return values
+
+def morton_order(points):
+    points = np.asarray(points, dtype=np.float64)
+    low = points.min(axis=0)
+    extent = np.maximum(points.max(axis=0) - low, 1e-12)
+    cells = np.clip((points - low) / extent * 1023.0, 0, 1023).astype(np.uint32)
+    codes = part_bits(cells[:, 0]) | (part_bits(cells[:, 1]) << 1) | (part_bits(cells[:, 2]) << 2)
+    return np.argsort(codes, kind='stable')
+
+def previous_occurrences(indices):
+    # For every position, the position of the previous use of the same vertex, or -1
+    order = np.argsort(indices, kind='stable')
+    sorted_indices = indices[order]
+    previous = np.full(len(indices), -1, dtype=np.int64)
+    repeated = sorted_indices[1:] == sorted_indices[:-1]
+    previous[order[1:][repeated]] = order[:-1][repeated]
+    return previous
+
+def chunk_triangle_ranges(faces, max_vertices=MAX_BLOCK_VERTICES):
+    # Greedily take the longest run of triangles that uses at most max_vertices unique
+    # vertices. A vertex is new to the run starting at triangle `start` if its previous
+    # use lies before the run, so a cumulative sum gives the unique count for every end.
+    flat = faces.reshape(-1)
+    previous = previous_occurrences(flat)
+    ranges = []
+    start = 0
+    while start < len(faces):
+        first = start * 3
+        unique_counts = np.cumsum(previous[first:] < first)[2::3]
+        count = int(np.searchsorted(unique_counts, max_vertices, side='right'))
+        ranges.append((start, start + count))
+        start += count
+    return ranges
+
+def split_into_blocks(obj_data, max_vertices=MAX_BLOCK_VERTICES):
+    vertex_count = len(obj_data['vertices'])
+    if vertex_count <= max_vertices:
+        return [obj_data]
+
+    faces = np.asarray(obj_data['faces']).reshape(-1, 3)
+    vertices = np.asarray(obj_data['vertices'])
+    # Order triangles along a Z-order curve so each block covers a compact region
+    faces = faces[morton_order(vertices[faces].mean(axis=1))]
+
+    blocks = []
+    for start, end in chunk_triangle_ranges(faces, max_vertices):
+        used_vertices, local_faces = np.unique(faces[start:end], return_inverse=True)
+        block_data = dict(obj_data)
+        for name in VERTEX_ATTRIBUTES:
+            block_data[name] = np.asarray(obj_data[name])[used_vertices]
+        block_data['faces'] = local_faces.reshape(-1, 3)
+        block_data['face_indices_count'] = (end - start) * 3
+        blocks.append(block_data)
+    return blocks
+
+VERTEX_CACHE_SIZE = 16
+
+def cache_miss_count(faces, cache_size=VERTEX_CACHE_SIZE):
+    # Simulate a FIFO post-transform cache. A vertex is still cached while fewer than
+    # cache_size misses have happened since it was loaded. Each index depends on the
+    # misses before it, so this stays a Python loop (about 0.1s per 65k-vertex block)
+    flat = np.asarray(faces).reshape(-1)
+    loaded_at = [-cache_size - 1] * (int(flat.max()) + 1 if len(flat) else 0)
+    misses = 0
+    for vertex in flat.tolist():
+        if misses - loaded_at[vertex] > cache_size:
+            loaded_at[vertex] = misses
+            misses += 1
+    return misses
+
+def cache_stats(faces, vertex_count, cache_size=VERTEX_CACHE_SIZE, misses=None):
+    # misses: a count already known for these faces, such as the one tipsify returns
+    if misses is None:
+        misses = cache_miss_count(faces, cache_size)
+    triangle_count = len(np.asarray(faces).reshape(-1, 3))
+    return {
+        'acmr': misses / max(triangle_count, 1),
+        'atvr': misses / max(vertex_count, 1),
+    }
+
+def tipsify(faces, vertex_count, cache_size=VERTEX_CACHE_SIZE):
+    # Tipsify triangle ordering (Sander, Nehab and Barczak 2007). Fans around the current
+    # vertex, then moves to the cached neighbour that is least likely to be evicted
+    # before its remaining triangles are emitted, falling back to a dead-end stack.
+    # Returns the triangle order and its FIFO cache misses, which are counted exactly as
+    # cache_miss_count would count them for faces[order]
+    faces = np.asarray(faces).reshape(-1, 3)
+    triangle_count = len(faces)
+    flat = faces.reshape(-1)
+
+    # Vertex -> triangle adjacency in CSR form
+    live = np.bincount(flat, minlength=vertex_count)
+    offsets = np.concatenate(([0], np.cumsum(live)))
+    adjacency = (np.argsort(flat, kind='stable') // 3).tolist()
+    offsets = offsets.tolist()
+    live = live.tolist()
+    triangles = faces.tolist()
+
+    cache_time = [0] * vertex_count
+    emitted = [False] * triangle_count
+    dead_end = []
+    order = []
+    timestamp = cache_size + 1
+    cursor = 0
+    fanning = 0 if triangle_count else -1
+
+    while fanning >= 0:
+        candidates = []
+        for t in adjacency[offsets[fanning]:offsets[fanning + 1]]:
+            if emitted[t]:
+                continue
+            emitted[t] = True
+            order.append(t)
+            for v in triangles[t]:
+                dead_end.append(v)
+                candidates.append(v)
+                live[v] -= 1
+                if timestamp - cache_time[v] > cache_size:
+                    cache_time[v] = timestamp
+                    timestamp += 1
+
+        fanning = -1
+        best_priority = -1
+        for v in candidates:
+            if live[v] > 0:
+                priority = 0
+                if timestamp - cache_time[v] + 2 * live[v] <= cache_size:
+                    priority = timestamp - cache_time[v]
+                if priority > best_priority:
+                    best_priority = priority
+                    fanning = v
+
+        if fanning == -1:
+            while dead_end:
+                v = dead_end.pop()
+                if live[v] > 0:
+                    fanning = v
+                    break
+        if fanning == -1:
+            while cursor < vertex_count:
+                if live[cursor] > 0:
+                    fanning = cursor
+                    break
+                cursor += 1
+
+    return np.array(order, dtype=np.int64), timestamp - cache_size - 1
+
+def reorder_vertices_by_first_use(faces, vertex_count):
+    flat = np.asarray(faces).reshape(-1)
+    used, first_use = np.unique(flat, return_index=True)
+    vertex_order = used[np.argsort(first_use, kind='stable')]
+    remap = np.full(vertex_count, -1, dtype=np.int64)
+    remap[vertex_order] = np.arange(len(vertex_order))
+    return vertex_order, remap[flat].reshape(-1, 3)
+
+def optimize_vertex_cache(obj_data, cache_size=VERTEX_CACHE_SIZE):
+    faces = np.asarray(obj_data['faces']).reshape(-1, 3)
+    vertex_count = len(obj_data['vertices'])
+    before = cache_stats(faces, vertex_count, cache_size)
+
+    order, misses = tipsify(faces, vertex_count, cache_size)
+    # Renumbering vertices by first use leaves the miss count unchanged
+    vertex_order, faces = reorder_vertices_by_first_use(faces[order], vertex_count)
+
+    optimized = dict(obj_data)
+    for name in VERTEX_ATTRIBUTES:
+        optimized[name] = np.asarray(obj_data[name])[vertex_order]
+    optimized['faces'] = faces
+    optimized['face_indices_count'] = len(faces) * 3
+    after = cache_stats(faces, len(vertex_order), cache_size, misses)
+    return optimized, before, after
+
+# Collapses that would turn a surviving face by more than 60 degrees are rejected
+LOD_MIN_NORMAL_DOT = 0.5
+
+def parse_lod_levels(text):
+    # "0.5, 0.25" keeps that fraction of each object's triangles; "5000" is a triangle budget
+    levels = []
+    for item in text.replace(';', ',').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        level = float(item)
+        if level <= 0.0:
+            raise ValueError(f"LOD level {item} must be greater than zero")
+        levels.append(level)
+    return levels
+
+def lod_triangle_target(triangle_count, level):
+    if level <= 1.0:
+        return max(1, int(triangle_count * level))
+    return min(triangle_count, int(level))
+
+def undirected_edges(faces, vertex_count):
+    a = faces.reshape(-1)
+    b = np.roll(faces, -1, axis=1).reshape(-1)
+    return np.minimum(a, b) * vertex_count + np.maximum(a, b)
+
+def locked_vertices(faces, vertex_count):
+    # Welded vertices are split along UV seams and hard edges, so those show up as open
+    # edges of the welded mesh, like real borders. Their vertices are never removed
+    keys, counts = np.unique(undirected_edges(faces, vertex_count), return_counts=True)
+    open_keys = keys[counts != 2]
+    locked = np.zeros(vertex_count, dtype=bool)
+    locked[open_keys // vertex_count] = True
+    locked[open_keys % vertex_count] = True
+    return locked
+
+def face_normals(positions, faces):
+    p0 = positions[faces[:, 0]]
+    return np.cross(positions[faces[:, 1]] - p0, positions[faces[:, 2]] - p0)
+
+def vertex_quadrics(positions, faces, vertex_count):
+    # Area-weighted plane quadrics, stored as the 10 distinct coefficients of the 4x4 matrix
+    normals = face_normals(positions, faces)
+    areas = np.linalg.norm(normals, axis=1)
+    a, b, c = (normals / np.maximum(areas, 1e-30)[:, None]).T
+    d = -(a * positions[faces[:, 0], 0] + b * positions[faces[:, 0], 1] + c * positions[faces[:, 0], 2])
+    face_quadrics = areas[:, None] * np.stack([
+        a * a, 2 * a * b, 2 * a * c, 2 * a * d, b * b, 2 * b * c, 2 * b * d, c * c, 2 * c * d, d * d,
+    ], axis=1)
+    quadrics = np.zeros((vertex_count, 10))
+    for corner in range(3):
+        np.add.at(quadrics, faces[:, corner], face_quadrics)
+    return quadrics
+
+def quadric_error(quadrics, points):
+    x, y, z = points.T
+    q = quadrics.T
+    return x * (q[0] * x + q[1] * y + q[2] * z + q[3]) + y * (q[4] * y + q[5] * z + q[6]) + z * (q[7] * z + q[8]) + q[9]
+
+def expand_ranges(starts, lengths):
+    # Flat indices of the ranges [start, start + length), and the range each came from
+    owners = np.repeat(np.arange(len(starts)), lengths)
+    local = np.arange(len(owners)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(starts, lengths) + local, owners
+
+def face_mask(faces, vertex_mask):
+    # Faces with at least one corner in vertex_mask
+    return vertex_mask[faces].any(axis=1)
+
+def both_directions(faces):
+    # (u, v) for every edge of faces in both directions; shared edges appear twice
+    a = faces.reshape(-1)
+    b = np.roll(faces, -1, axis=1).reshape(-1)
+    return np.concatenate([a, b]), np.concatenate([b, a])
+
+def update_collapse_costs(positions, faces, quadrics, locked, stuck, best_cost, dirty):
+    # Cheapest collapse cost of every vertex in dirty. Only the edges around those
+    # vertices are evaluated; every other vertex keeps the cost from earlier passes
+    u, v = both_directions(faces[face_mask(faces, dirty)])
+    keep = dirty[u] & ~(locked | stuck)[u]
+    u, v = u[keep], v[keep]
+    best_cost[dirty] = np.inf
+    np.minimum.at(best_cost, u, quadric_error(quadrics[u] + quadrics[v], positions[v]))
+
+def collapse_pass(positions, faces, normals, quadrics, locked, stuck, best_cost, max_collapses, priority):
+    # One round of half-edge collapses u -> v. Among the cheaper half of the candidate
+    # vertices, those with the lowest priority within two rings collapse, so their
+    # neighbourhoods never overlap and all collapses apply at once. best_cost, stuck and
+    # the per-face normals carry over between passes and are only refreshed around the
+    # collapsed vertices; edge adjacency is built for the faces near the selected
+    # vertices alone. Returns the new (faces, normals), or None when nothing can collapse
+    vertex_count = len(positions)
+    movable = np.flatnonzero(np.isfinite(best_cost))
+    if not len(movable):
+        return None
+
+    # Costs vary smoothly over a surface, so picking local cost minima would only find
+    # a few vertices per pass. A random priority gives a dense independent set instead
+    eligible = movable[best_cost[movable] <= np.median(best_cost[movable])]
+    in_play = np.zeros(vertex_count, dtype=bool)
+    in_play[eligible] = True
+    u, v = both_directions(faces[face_mask(faces, in_play)])
+    rank = np.full(vertex_count, len(priority), dtype=np.int64)
+    rank[eligible] = priority[eligible]
+    ring_min = rank.copy()
+    np.minimum.at(ring_min, u, rank[v])
+    ring2_min = ring_min.copy()
+    np.minimum.at(ring2_min, u, ring_min[v])
+    selected = eligible[rank[eligible] == ring2_min[eligible]]
+    if not len(selected):
+        return None
+
+    # Adjacency of the selected vertices and their neighbours, which is all the link
+    # and face checks below look at
+    near = np.zeros(vertex_count, dtype=bool)
+    near[selected] = True
+    near[v[near[u]]] = True
+    local = np.flatnonzero(face_mask(faces, near))
+    local_faces = faces[local]
+    u, v = both_directions(local_faces)
+    # Sorting beats np.unique here, which hashes int64 keys on recent NumPy
+    directed = np.sort(u * vertex_count + v)
+    directed = directed[np.concatenate([[True], directed[1:] != directed[:-1]])]
+    u = directed // vertex_count
+    v = directed % vertex_count
+
+    def edge_ranges(vertices):
+        starts = np.searchsorted(u, vertices)
+        return starts, np.searchsorted(u, vertices, side='right') - starts
+
+    # Every target of the selected vertices, checked for the link condition (an
+    # interior edge shares exactly two neighbours) and for flipped or squashed faces
+    rows, owner = expand_ranges(*edge_ranges(selected))
+    su, sv = u[rows], v[rows]
+    valid = np.ones(len(rows), dtype=bool)
+
+    ring, ring_owner = expand_ranges(*edge_ranges(su))
+    keys = sv[ring_owner] * vertex_count + v[ring]
+    found = directed[np.minimum(np.searchsorted(directed, keys), len(directed) - 1)] == keys
+    valid &= np.bincount(ring_owner[found], minlength=len(rows)) == 2
+
+    corners = local_faces.reshape(-1)
+    corner_order = np.argsort(corners, kind='stable')
+    sorted_corners = corners[corner_order]
+    face_starts = np.searchsorted(sorted_corners, su)
+    face_rows, face_owner = expand_ranges(face_starts, np.searchsorted(sorted_corners, su, side='right') - face_starts)
+    around_index = corner_order[face_rows] // 3
+    around = local_faces[around_index]
+    row_u = su[face_owner][:, None]
+    row_v = sv[face_owner][:, None]
+    survives = ~(around == row_v).any(axis=1)
+    before = normals[local[around_index[survives]]]
+    after = face_normals(positions, np.where(around == row_u, row_v, around)[survives])
+    before_length = np.linalg.norm(before, axis=1)
+    after_length = np.linalg.norm(after, axis=1)
+    dot = np.einsum('ij,ij->i', before, after) / np.maximum(before_length * after_length, 1e-30)
+    bad = (dot < LOD_MIN_NORMAL_DOT) | (after_length <= before_length * 1e-6)
+    valid[face_owner[survives][bad]] = False
+
+    # Cheapest valid target per selected vertex. Vertices without one wait until
+    # something around them changes
+    row_cost = np.where(valid, quadric_error(quadrics[su] + quadrics[sv], positions[sv]), np.inf)
+    order = np.lexsort((row_cost, owner))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = owner[order][1:] != owner[order][:-1]
+    chosen = order[first]
+    chosen = chosen[np.isfinite(row_cost[chosen])]
+    stuck[selected] = True
+    best_cost[selected] = np.inf
+    if not len(chosen):
+        return faces, normals
+    if len(chosen) > max_collapses:
+        chosen = chosen[np.argsort(row_cost[chosen], kind='stable')[:max_collapses]]
+
+    collapsing, targets = su[chosen], sv[chosen]
+    remap = np.arange(vertex_count)
+    remap[collapsing] = targets
+    quadrics[targets] += quadrics[collapsing]
+    changed = local[np.isin(local_faces, collapsing).any(axis=1)]
+    faces = faces.copy()
+    faces[changed] = remap[faces[changed]]
+    normals = normals.copy()
+    normals[changed] = face_normals(positions, faces[changed])
+    # Collapsed vertices are gone; their old neighbours may have valid collapses now
+    is_target = np.zeros(vertex_count, dtype=bool)
+    is_target[targets] = True
+    dirty = np.zeros(vertex_count, dtype=bool)
+    dirty[faces[local[face_mask(faces[local], is_target)]]] = True
+    stuck[dirty] = False
+    keep = (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])
+    faces, normals = faces[keep], normals[keep]
+    update_collapse_costs(positions, faces, quadrics, locked, stuck, best_cost, dirty)
+    return faces, normals
+
+def decimate(obj_data, target_triangles):
+    # Half-edge collapse with quadric error costs. Surviving vertices keep their exact
+    # attributes, and vertices on seams, hard edges and borders are never removed.
+    # Stops early if no collapse is left that keeps the surface intact
+    faces = np.asarray(obj_data['faces'], dtype=np.int64).reshape(-1, 3)
+    positions = np.asarray(obj_data['vertices'], dtype=np.float64).reshape(-1, 3)
+    vertex_count = len(positions)
+    source_triangles = len(faces)
+
+    if len(faces) > target_triangles:
+        locked = locked_vertices(faces, vertex_count)
+        stuck = np.zeros(vertex_count, dtype=bool)
+        quadrics = vertex_quadrics(positions, faces, vertex_count)
+        normals = face_normals(positions, faces)
+        best_cost = np.full(vertex_count, np.inf)
+        update_collapse_costs(positions, faces, quadrics, locked, stuck, best_cost, np.ones(vertex_count, dtype=bool))
+        # Fixed seed, so the same mesh always decimates the same way
+        rng = np.random.default_rng(0)
+        while len(faces) > target_triangles:
+            # An interior collapse removes two triangles
+            collapsed = collapse_pass(positions, faces, normals, quadrics, locked, stuck, best_cost,
+                                      max(1, (len(faces) - target_triangles + 1) // 2), rng.permutation(vertex_count))
+            if collapsed is None:
+                break
+            faces, normals = collapsed
+
+    vertex_order, faces = reorder_vertices_by_first_use(faces, vertex_count)
+    decimated = dict(obj_data)
+    for name in VERTEX_ATTRIBUTES:
+        decimated[name] = np.asarray(obj_data[name])[vertex_order]
+    decimated['faces'] = faces
+    decimated['face_indices_count'] = len(faces) * 3
+    stats = {
+        'source_triangles': source_triangles,
+        'target_triangles': target_triangles,
+        'triangles': len(faces),
+        'vertices': len(vertex_order),
+    }
+    return decimated, stats
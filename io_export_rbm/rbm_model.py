@@ -0,0 +1,122 @@
+# Intermediate representation consumed by the RBM serialiser in rbm_format.
+#
+# Nothing here depends on Blender: the exporter fills these from bpy data, but cached
+# arrays, procedural generators or other tools can build them directly and write a
+# file with rbm_format.write_model.
+import numpy as np
+
+class RBMMaterial:
+    __slots__ = ('node_group_name', 'flags_value', 'texture_paths', 'node_values', 'color_values',
+                 'boolean_values', 'material_key')
+
+    def __init__(self, node_group_name, flags_value=0, texture_paths=(), node_values=None, color_values=None,
+                 boolean_values=None, material_key=None):
+        self.node_group_name = node_group_name
+        self.flags_value = flags_value
+        # (byte length, path) pairs as written in the texture table; bare strings are accepted too
+        self.texture_paths = [
+            (len(path.encode('utf-8')), path) if isinstance(path, str) else tuple(path) for path in texture_paths
+        ]
+        self.node_values = node_values or {}
+        self.color_values = color_values or {}
+        self.boolean_values = boolean_values or {}
+        # Content hash used by the material block cache; None means always repack
+        self.material_key = material_key
+
+    @classmethod
+    def from_block_data(cls, obj_data):
+        return cls(
+            obj_data['node_group_name'],
+            obj_data.get('flags_value', 0),
+            obj_data.get('texture_paths', ()),
+            obj_data.get('node_values'),
+            obj_data.get('color_values'),
+            obj_data.get('boolean_values'),
+            obj_data.get('material_key'),
+        )
+
+class RBMMesh:
+    # One block of the file: a material and up to 65,535 vertices. Attributes are
+    # contiguous little-endian float32 arrays, so packing is a few strided copies
+    __slots__ = ('name', 'material', 'positions', 'uv1', 'uv2', 'uv3', 'normals', 'tangents', 'indices')
+
+    def __init__(self, material, positions, indices, uv1=None, uv2=None, uv3=None, normals=None, tangents=None,
+                 name=None):
+        self.name = name
+        self.material = material
+        self.positions = np.ascontiguousarray(positions, dtype='<f4').reshape(-1, 3)
+        vertex_count = len(self.positions)
+        self.uv1 = float_attribute(uv1, (vertex_count, 2))
+        self.uv2 = float_attribute(uv2, (vertex_count, 2))
+        self.uv3 = float_attribute(uv3, (vertex_count, 2))
+        # Normals and tangents are already packed with rbm_format.compress_normals
+        self.normals = float_attribute(normals, (vertex_count,))
+        self.tangents = float_attribute(tangents, (vertex_count,))
+        indices = np.ascontiguousarray(indices)
+        if indices.dtype.kind not in 'iu':
+            indices = indices.astype(np.int32)
+        self.indices = indices.reshape(-1, 3)
+
+    @classmethod
+    def from_block_data(cls, obj_data):
+        return cls(
+            RBMMaterial.from_block_data(obj_data),
+            obj_data['vertices'],
+            obj_data['faces'],
+            obj_data.get('uv1'),
+            obj_data.get('uv2'),
+            obj_data.get('uv3'),
+            obj_data.get('normals'),
+            obj_data.get('tangents'),
+            obj_data.get('object_name'),
+        )
+
+    @property
+    def vertex_count(self):
+        return len(self.positions)
+
+    @property
+    def triangle_count(self):
+        return len(self.indices)
+
+    def attributes(self):
+        # Arrays by their VERTEX_STREAMS name
+        return {
+            'vertices': self.positions,
+            'uv1': self.uv1,
+            'uv2': self.uv2,
+            'uv3': self.uv3,
+            'normals': self.normals,
+            'tangents': self.tangents,
+        }
+
+    def bounds(self):
+        if not len(self.positions):
+            return None
+        return self.positions.min(axis=0), self.positions.max(axis=0)
+
+class RBMModel:
+    __slots__ = ('meshes',)
+
+    def __init__(self, meshes=()):
+        self.meshes = [as_mesh(mesh) for mesh in meshes]
+
+    def min_max_positions(self):
+        bounds = [mesh.bounds() for mesh in self.meshes]
+        bounds = [item for item in bounds if item is not None]
+        if not bounds:
+            return (0.0,) * 6
+        bounds_min = np.min([item[0] for item in bounds], axis=0)
+        bounds_max = np.max([item[1] for item in bounds], axis=0)
+        return tuple(bounds_min.tolist() + bounds_max.tolist())
+
+def float_attribute(values, shape):
+    if values is None:
+        return np.zeros(shape, dtype='<f4')
+    return np.ascontiguousarray(values, dtype='<f4').reshape(shape)
+
+def as_mesh(block):
+    # The mesh utilities in rbm_mesh still pass blocks around as dicts
+    if isinstance(block, RBMMesh):
+        return block
+    return RBMMesh.from_block_data(block)
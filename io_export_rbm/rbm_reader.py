@@ -0,0 +1,290 @@
+# Memory-mapped RBM reader and validator.
+#
+#   python rbm_reader.py inspect car.rbm [--blocks] [--json]
+#   python rbm_reader.py diff old.rbm new.rbm
+#
+# Vertex streams and index buffers are NumPy views straight into the mapped file, so
+# large files are never copied into Python objects. Only the material headers and
+# texture tables are unpacked.
+import argparse
+import json
+import struct
+import sys
+import numpy as np
+from rbm_format import (
+    BLOCK_TERMINATOR, BOUNDS_AND_COUNT_STRUCT, COMPILED_MATERIAL_SCHEMAS, FILE_HEADER, VERTEX_ATTRIBUTE_TYPES,
+    VERTEX_STREAMS,
+)
+
+SCHEMAS_BY_MAGIC = {schema['magic']: schema for schema in COMPILED_MATERIAL_SCHEMAS.values()}
+
+HEADER_TAIL = struct.pack('<I', 8)
+HEADER_SIZE = len(FILE_HEADER) + BOUNDS_AND_COUNT_STRUCT.size + len(HEADER_TAIL)
+
+U32 = struct.Struct('<I')
+
+class RBMFormatError(ValueError):
+    pass
+
+class RBMBlock:
+    def __init__(self, index, offset):
+        self.index = index
+        self.offset = offset
+        self.size = 0
+        self.node_group_name = None
+        self.version = None
+        self.material = {}
+        self.texture_paths = []
+        self.trailer = None
+        self.streams = []
+        self.indices = None
+
+    @property
+    def vertex_count(self):
+        return len(self.streams[0]) if self.streams else 0
+
+    def attribute(self, name):
+        for stream in self.streams:
+            if name in stream.dtype.names:
+                return stream[name]
+        raise KeyError(f"Block {self.index} ({self.node_group_name}) has no '{name}' attribute")
+
+    def summary(self):
+        return {
+            'index': self.index,
+            'offset': self.offset,
+            'size': self.size,
+            'node_group': self.node_group_name,
+            'version': self.version,
+            'vertices': self.vertex_count,
+            'triangles': len(self.indices) // 3,
+            'textures': [path for path in self.texture_paths if path],
+            'streams': [list(stream.dtype.names) for stream in self.streams],
+        }
+
+class RBMFile:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.data = np.memmap(file_path, dtype=np.uint8, mode='r')
+        self.blocks = []
+        self.parse()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def close(self):
+        # Views handed out keep the mapping alive until they are dropped as well
+        self.blocks = []
+        self.data = None
+
+    def read(self, offset, size, what):
+        if offset + size > len(self.data):
+            raise RBMFormatError(f"{what} at offset {offset} runs past the end of the file ({len(self.data)} bytes)")
+        return self.data[offset:offset + size]
+
+    def unpack(self, unpacker, offset, what):
+        return unpacker.unpack(self.read(offset, unpacker.size, what).tobytes())
+
+    def parse(self):
+        if self.read(0, len(FILE_HEADER), "File header").tobytes() != FILE_HEADER:
+            raise RBMFormatError("Not an RBM file: header does not match RBMDL version 1")
+        *bounds, block_count = self.unpack(BOUNDS_AND_COUNT_STRUCT, len(FILE_HEADER), "Bounds")
+        self.min_max_positions = tuple(bounds)
+        self.block_count = block_count
+        offset = len(FILE_HEADER) + BOUNDS_AND_COUNT_STRUCT.size
+        if self.read(offset, len(HEADER_TAIL), "Header tail").tobytes() != HEADER_TAIL:
+            raise RBMFormatError(f"Unexpected header tail at offset {offset}")
+
+        offset = HEADER_SIZE
+        for index in range(block_count):
+            block = self.parse_block(index, offset)
+            self.blocks.append(block)
+            offset += block.size
+
+        if offset != len(self.data):
+            raise RBMFormatError(f"{len(self.data) - offset} trailing bytes after block {block_count - 1}")
+
+    def parse_block(self, index, offset):
+        block = RBMBlock(index, offset)
+        magic = self.read(offset, 4, f"Block {index} magic").tobytes()
+        schema = SCHEMAS_BY_MAGIC.get(magic)
+        if schema is None:
+            raise RBMFormatError(f"Block {index} at offset {offset} has unknown magic {magic.hex().upper()}")
+        block.node_group_name = schema['node_group_name']
+
+        values = list(self.unpack(schema['struct'], offset, f"Block {index} material header"))
+        cursor = offset + schema['struct'].size
+        block.version = values[1]
+        position = 2
+        for kind, name, arg_count, default in schema['compiled_fields']:
+            value = values[position] if arg_count == 1 else tuple(values[position:position + arg_count])
+            block.material[name] = value
+            position += arg_count
+        texture_count = values[position]
+        if texture_count != schema['texture_count']:
+            raise RBMFormatError(f"Block {index} ({block.node_group_name}) lists {texture_count} textures, "
+                                 f"expected {schema['texture_count']}")
+
+        for _ in range(texture_count):
+            (length,) = self.unpack(U32, cursor, f"Block {index} texture length")
+            cursor += U32.size
+            path = self.read(cursor, length, f"Block {index} texture path").tobytes()
+            try:
+                block.texture_paths.append(path.decode('utf-8'))
+            except UnicodeDecodeError:
+                raise RBMFormatError(f"Block {index} has a texture path that is not UTF-8 at offset {cursor}")
+            cursor += length
+
+        block.trailer = self.read(cursor, len(schema['trailer']), f"Block {index} trailer").tobytes()
+        cursor += len(schema['trailer'])
+
+        for names in VERTEX_STREAMS[block.node_group_name]:
+            (count,) = self.unpack(U32, cursor, f"Block {index} vertex count")
+            cursor += U32.size
+            dtype = np.dtype([(name, VERTEX_ATTRIBUTE_TYPES[name]) for name in names])
+            raw = self.read(cursor, count * dtype.itemsize, f"Block {index} {'/'.join(names)} stream")
+            block.streams.append(raw.view(dtype))
+            cursor += count * dtype.itemsize
+
+        (index_count,) = self.unpack(U32, cursor, f"Block {index} index count")
+        cursor += U32.size
+        block.indices = self.read(cursor, index_count * 2, f"Block {index} index buffer").view('<u2')
+        cursor += index_count * 2
+
+        terminator = self.read(cursor, len(BLOCK_TERMINATOR), f"Block {index} terminator").tobytes()
+        if terminator != BLOCK_TERMINATOR:
+            raise RBMFormatError(f"Block {index} ({block.node_group_name}) ends with {terminator.hex().upper()} "
+                                 f"at offset {cursor}, expected {BLOCK_TERMINATOR.hex().upper()}")
+        cursor += len(BLOCK_TERMINATOR)
+
+        block.size = cursor - offset
+        return block
+
+    def validate(self):
+        # Structural errors are raised while parsing; these are the checks a parsed file can still fail
+        problems = []
+        bounds_min = np.array(self.min_max_positions[:3], dtype=np.float32)
+        bounds_max = np.array(self.min_max_positions[3:], dtype=np.float32)
+        for block in self.blocks:
+            schema = COMPILED_MATERIAL_SCHEMAS[block.node_group_name]
+            label = f"Block {block.index} ({block.node_group_name})"
+            if block.version != schema['version']:
+                problems.append(f"{label}: version {block.version}, expected {schema['version']}")
+            if block.trailer != schema['trailer']:
+                problems.append(f"{label}: trailer {block.trailer.hex().upper()} differs from {schema['trailer'].hex().upper()}")
+
+            counts = {len(stream) for stream in block.streams}
+            if len(counts) > 1:
+                problems.append(f"{label}: vertex streams have different lengths {sorted(counts)}")
+            if len(block.indices) % 3:
+                problems.append(f"{label}: {len(block.indices)} indices is not a whole number of triangles")
+            if len(block.indices) and int(block.indices.max()) >= block.vertex_count:
+                problems.append(f"{label}: index {int(block.indices.max())} out of range for {block.vertex_count} vertices")
+
+            if block.vertex_count:
+                vertices = block.attribute('vertices')
+                if not np.isfinite(vertices).all():
+                    problems.append(f"{label}: non-finite vertex positions")
+                elif (vertices.min(axis=0) < bounds_min).any() or (vertices.max(axis=0) > bounds_max).any():
+                    problems.append(f"{label}: vertices lie outside the file bounds")
+        return problems
+
+def diff_files(a, b):
+    differences = []
+    if a.min_max_positions != b.min_max_positions:
+        differences.append(f"Bounds: {a.min_max_positions} != {b.min_max_positions}")
+    if a.block_count != b.block_count:
+        differences.append(f"Block count: {a.block_count} != {b.block_count}")
+
+    for block_a, block_b in zip(a.blocks, b.blocks):
+        label = f"Block {block_a.index}"
+        if block_a.node_group_name != block_b.node_group_name:
+            differences.append(f"{label}: node group {block_a.node_group_name} != {block_b.node_group_name}")
+            continue
+        for name, value in block_a.material.items():
+            if value != block_b.material[name]:
+                differences.append(f"{label}: {name} {value} != {block_b.material[name]}")
+        for slot, (path_a, path_b) in enumerate(zip(block_a.texture_paths, block_b.texture_paths)):
+            if path_a != path_b:
+                differences.append(f"{label}: texture {slot} '{path_a}' != '{path_b}'")
+        if block_a.vertex_count != block_b.vertex_count:
+            differences.append(f"{label}: {block_a.vertex_count} vertices != {block_b.vertex_count}")
+        else:
+            for stream_a, stream_b in zip(block_a.streams, block_b.streams):
+                for name in stream_a.dtype.names:
+                    field_a = stream_a[name]
+                    field_b = stream_b[name]
+                    if not np.array_equal(field_a, field_b):
+                        if field_a.dtype.kind == 'f':
+                            delta = float(np.abs(field_a - field_b).max())
+                            differences.append(f"{label}: {name} differs (max abs difference {delta:g})")
+                        else:
+                            differences.append(f"{label}: {name} differs")
+        if not np.array_equal(block_a.indices, block_b.indices):
+            differences.append(f"{label}: index buffers differ ({len(block_a.indices)} vs {len(block_b.indices)} indices)")
+    return differences
+
+def inspect_main(args):
+    with RBMFile(args.file) as rbm:
+        problems = rbm.validate()
+        if args.json:
+            json.dump({
+                'file': args.file,
+                'bounds': rbm.min_max_positions,
+                'blocks': [block.summary() for block in rbm.blocks],
+                'problems': problems,
+            }, sys.stdout, indent=2)
+            print()
+        else:
+            print(f"{args.file}: {rbm.block_count} blocks, {len(rbm.data)} bytes")
+            print(f"Bounds: {rbm.min_max_positions}")
+            for block in rbm.blocks:
+                print(f"  [{block.index}] {block.node_group_name} v{block.version}: {block.vertex_count} vertices, "
+                      f"{len(block.indices) // 3} triangles, {block.size} bytes at {block.offset}")
+                if args.blocks:
+                    for name, value in block.material.items():
+                        print(f"      {name}: {value}")
+                    for path in block.texture_paths:
+                        if path:
+                            print(f"      texture: {path}")
+            for problem in problems:
+                print(f"Problem: {problem}")
+            print("OK" if not problems else f"{len(problems)} problems")
+    return 0 if not problems else 1
+
+def diff_main(args):
+    with RBMFile(args.a) as a, RBMFile(args.b) as b:
+        differences = diff_files(a, b)
+    for difference in differences:
+        print(difference)
+    print("Files are equivalent" if not differences else f"{len(differences)} differences")
+    return 0 if not differences else 1
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect, validate and compare RBM files")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    inspect_parser = commands.add_parser('inspect', help="Validate a file and list its blocks")
+    inspect_parser.add_argument('file')
+    inspect_parser.add_argument('--blocks', action='store_true', help="Also print material values and textures")
+    inspect_parser.add_argument('--json', action='store_true', help="Print a JSON report instead")
+
+    diff_parser = commands.add_parser('diff', help="Compare two files block by block")
+    diff_parser.add_argument('a')
+    diff_parser.add_argument('b')
+
+    args = parser.parse_args(argv)
+    try:
+        if args.command == 'inspect':
+            return inspect_main(args)
+        return diff_main(args)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        return 2
+
+if __name__ == "__main__":
+    sys.exit(main())
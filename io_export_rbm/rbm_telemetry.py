@@ -0,0 +1,191 @@
+import json
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# One logger for the whole add-on. It only prints warnings unless the export dialog
+# (or a batch job) asks for more, so large exports don't spend time on console output
+log = logging.getLogger('io_export_rbm')
+log.setLevel(logging.WARNING)
+log.propagate = False
+
+LOG_LEVELS = ('WARNING', 'INFO', 'DEBUG')
+
+WELD_STATS = ('loops', 'source_vertices', 'vertices', 'splits', 'welds')
+
+def set_log_level(level):
+    if not log.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter('RBM %(levelname)s: %(message)s'))
+        log.addHandler(handler)
+    log.setLevel(getattr(logging, level) if isinstance(level, str) else level)
+
+class ExportTelemetry:
+    # Wall time per stage and per object, and the size of every written block.
+    # Stages are timed from the packing threads too, so updates take a lock
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = time.perf_counter()
+        self.total_seconds = None
+        self.stages = {}
+        self.objects = {}
+        self.blocks = []
+        self.skipped = []
+        self.textures = []
+        self.caches = {}
+        self.vertex_total = 0
+        self.byte_total = 0
+
+    @contextmanager
+    def stage(self, name, object_name=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self.lock:
+                self.stages[name] = self.stages.get(name, 0.0) + seconds
+                if object_name is not None:
+                    record = self.object_record(object_name)
+                    record['stages'][name] = record['stages'].get(name, 0.0) + seconds
+
+    def object_record(self, object_name):
+        record = self.objects.get(object_name)
+        if record is None:
+            record = self.objects[object_name] = {'stages': {}, 'vertices': 0, 'triangles': 0, 'blocks': 0, 'bytes': 0}
+        return record
+
+    def skip(self, object_name, reason):
+        with self.lock:
+            self.skipped.append({'object': object_name, 'reason': reason})
+
+    def add_block(self, mesh, byte_count, lod=0):
+        vertex_count = mesh.vertex_count
+        triangle_count = mesh.triangle_count
+        object_name = mesh.name
+        with self.lock:
+            self.vertex_total += vertex_count
+            self.byte_total += byte_count
+            self.blocks.append({
+                'object': object_name,
+                'lod': lod,
+                'node_group': mesh.material.node_group_name,
+                'vertices': vertex_count,
+                'triangles': triangle_count,
+                'bytes': byte_count,
+            })
+            # Per-object totals describe the base mesh; LOD blocks are only listed in block_sizes
+            if object_name is not None and lod == 0:
+                record = self.object_record(object_name)
+                record['vertices'] += vertex_count
+                record['triangles'] += triangle_count
+                record['blocks'] += 1
+                record['bytes'] += byte_count
+
+    def add_weld(self, object_name, weld_stats):
+        # Loops, split and welded vertex counts from build_geometry, per object
+        with self.lock:
+            self.object_record(object_name)['weld'] = {name: int(weld_stats[name]) for name in WELD_STATS}
+
+    def add_vertex_cache(self, object_name, lod, block, triangle_count, before, after):
+        # ACMR/ATVR of one block before and after optimize_vertex_cache
+        with self.lock:
+            self.object_record(object_name).setdefault('vertex_cache', []).append({
+                'lod': lod,
+                'block': block,
+                'triangles': triangle_count,
+                'acmr_before': before['acmr'],
+                'acmr_after': after['acmr'],
+                'atvr_before': before['atvr'],
+                'atvr_after': after['atvr'],
+            })
+
+    def vertex_cache_summary(self):
+        # Triangle-weighted ACMR over every optimised block, or None if none were
+        entries = [entry for record in self.objects.values() for entry in record.get('vertex_cache', ())]
+        triangles = sum(entry['triangles'] for entry in entries)
+        if not triangles:
+            return None
+        return {
+            'blocks': len(entries),
+            'acmr_before': round(sum(entry['acmr_before'] * entry['triangles'] for entry in entries) / triangles, 4),
+            'acmr_after': round(sum(entry['acmr_after'] * entry['triangles'] for entry in entries) / triangles, 4),
+        }
+
+    def add_lod(self, object_name, level, lod_stats, missed):
+        # Triangle counts of one decimated LOD, and whether it stopped well short of its target
+        with self.lock:
+            self.object_record(object_name).setdefault('lods', []).append(dict(lod_stats, level=level, missed=missed))
+
+    def lod_misses(self):
+        return [{'object': name, **entry} for name, record in self.objects.items()
+                for entry in record.get('lods', ()) if entry['missed']]
+
+    def add_texture(self, output_path, byte_count, encoded=True):
+        with self.lock:
+            self.textures.append({'path': output_path, 'bytes': byte_count, 'encoded': encoded})
+
+    def progress(self):
+        # Running totals for the progress display: objects started, vertices and bytes written
+        with self.lock:
+            return len(self.objects), self.vertex_total, self.byte_total
+
+    def record_cache(self, name, hits, misses):
+        with self.lock:
+            self.caches[name] = {'hits': hits, 'misses': misses}
+
+    def finish(self):
+        self.total_seconds = time.perf_counter() - self.start_time
+
+    def summary(self):
+        total_seconds = self.total_seconds if self.total_seconds is not None else time.perf_counter() - self.start_time
+        return {
+            'seconds': round(total_seconds, 6),
+            'blocks': len(self.blocks),
+            'vertices': sum(block['vertices'] for block in self.blocks),
+            'triangles': sum(block['triangles'] for block in self.blocks),
+            'bytes': sum(block['bytes'] for block in self.blocks),
+            'stages': {name: round(seconds, 6) for name, seconds in self.stages.items()},
+            'objects': {
+                name: dict(record, stages={stage: round(seconds, 6) for stage, seconds in record['stages'].items()})
+                for name, record in self.objects.items()
+            },
+            'weld': {name: sum(record['weld'][name] for record in self.objects.values() if 'weld' in record)
+                     for name in WELD_STATS},
+            'vertex_cache': self.vertex_cache_summary(),
+            'lod_misses': self.lod_misses(),
+            'block_sizes': self.blocks,
+            'caches': self.caches,
+            'textures': self.textures,
+            'skipped': self.skipped,
+        }
+
+    def report_line(self):
+        summary = self.summary()
+        stages = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in summary['stages'].items())
+        textures = ""
+        if self.textures:
+            encoded = sum(1 for texture in self.textures if texture['encoded'])
+            textures = f", {len(self.textures)} textures ({encoded} converted)"
+        weld = summary['weld']
+        welding = ""
+        if weld['loops']:
+            welding = (f", weld {weld['loops']} loops -> {weld['vertices']} vertices "
+                       f"({weld['splits']} split, {weld['welds']} welded)")
+        vertex_cache = ""
+        if summary['vertex_cache'] is not None:
+            vertex_cache = (f", ACMR {summary['vertex_cache']['acmr_before']:.3f} -> "
+                            f"{summary['vertex_cache']['acmr_after']:.3f}")
+        lod_misses = ""
+        if summary['lod_misses']:
+            lod_misses = f", {len(summary['lod_misses'])} LOD targets missed"
+        caches = "".join(f", {name} cache {stats['hits']}/{stats['hits'] + stats['misses']} hits"
+                         for name, stats in summary['caches'].items() if stats['hits'] or stats['misses'])
+        return (f"Exported {summary['blocks']} blocks ({summary['vertices']} vertices, {summary['triangles']} triangles, "
+                f"{summary['bytes'] / 1e6:.1f} MB){welding}{vertex_cache}{lod_misses}{textures}{caches} in {summary['seconds']:.2f}s: {stages}")
+
+    def dump(self, file_path):
+        with open(file_path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, indent=2)
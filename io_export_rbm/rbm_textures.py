@@ -0,0 +1,200 @@
+# DDS encoding for the textures referenced by exported materials.
+#
+# Nothing here depends on Blender: the exporter reads image pixels with bpy and
+# hands uint8 RGBA arrays to encode_texture_file, which runs in worker processes.
+# Every texture gets a full mip chain and is block-compressed with a NumPy BC1/BC3
+# encoder (principal-axis endpoints, nearest palette entry per texel).
+#
+# The output is a plain DDS file. Materials reference .ddsc, Avalanche's own texture
+# container, which is not written here: the .dds files still have to be converted
+# with the game's modding tools.
+import os
+import struct
+import numpy as np
+
+TEXTURE_FORMATS = ('BC1', 'BC3', 'RGBA8')
+
+# Written in place of the .ddsc extension the material block references
+TEXTURE_FILE_EXTENSION = '.dds'
+
+# Part of the texture cache key; bump it whenever encoder output changes
+TEXTURE_ENCODER_VERSION = 1
+
+DDS_MAGIC = b'DDS '
+DDS_HEADER_STRUCT = struct.Struct('<4s7I44x2I4s5I5I')
+
+DDSD_CAPS = 0x1
+DDSD_HEIGHT = 0x2
+DDSD_WIDTH = 0x4
+DDSD_PITCH = 0x8
+DDSD_PIXELFORMAT = 0x1000
+DDSD_MIPMAPCOUNT = 0x20000
+DDSD_LINEARSIZE = 0x80000
+DDPF_ALPHAPIXELS = 0x1
+DDPF_FOURCC = 0x4
+DDPF_RGB = 0x40
+DDSCAPS_COMPLEX = 0x8
+DDSCAPS_TEXTURE = 0x1000
+DDSCAPS_MIPMAP = 0x400000
+
+FOURCC = {'BC1': b'DXT1', 'BC3': b'DXT5'}
+BLOCK_BYTES = {'BC1': 8, 'BC3': 16}
+
+def resolve_texture_format(pixels, texture_format='AUTO'):
+    # AUTO picks BC3 only for images that actually use their alpha channel
+    if texture_format != 'AUTO':
+        return texture_format
+    return 'BC3' if (pixels[..., 3] < 255).any() else 'BC1'
+
+def downsample(level):
+    # 2x2 box filter; odd edges repeat their last row or column
+    height, width = level.shape[:2]
+    if height > 1 and height % 2:
+        level = np.concatenate([level, level[-1:]], axis=0)
+    if width > 1 and width % 2:
+        level = np.concatenate([level, level[:, -1:]], axis=1)
+    if level.shape[0] > 1:
+        level = 0.5 * (level[0::2] + level[1::2])
+    if level.shape[1] > 1:
+        level = 0.5 * (level[:, 0::2] + level[:, 1::2])
+    return level
+
+def mip_chain(pixels):
+    levels = [pixels]
+    level = pixels.astype(np.float32)
+    while level.shape[0] > 1 or level.shape[1] > 1:
+        level = downsample(level)
+        levels.append(np.clip(level + 0.5, 0, 255).astype(np.uint8))
+    return levels
+
+def texel_blocks(level):
+    # (block count, 16, 4) texels in row-major 4x4 blocks, edge texels repeated for partial blocks
+    height, width = level.shape[:2]
+    padded_height = (height + 3) // 4 * 4
+    padded_width = (width + 3) // 4 * 4
+    if (padded_height, padded_width) != (height, width):
+        level = np.pad(level, ((0, padded_height - height), (0, padded_width - width), (0, 0)), mode='edge')
+    blocks = level.reshape(padded_height // 4, 4, padded_width // 4, 4, 4).transpose(0, 2, 1, 3, 4)
+    return blocks.reshape(-1, 16, 4)
+
+def pack_565(colors):
+    colors = np.clip(np.rint(colors), 0, 255).astype(np.uint32)
+    return ((colors[..., 0] * 31 + 127) // 255 << 11) | ((colors[..., 1] * 63 + 127) // 255 << 5) | ((colors[..., 2] * 31 + 127) // 255)
+
+def unpack_565(packed):
+    packed = packed.astype(np.uint32)
+    red = (packed >> 11) & 31
+    green = (packed >> 5) & 63
+    blue = packed & 31
+    return np.stack([(red << 3) | (red >> 2), (green << 2) | (green >> 4), (blue << 3) | (blue >> 2)], axis=-1).astype(np.float32)
+
+def encode_color_blocks(blocks):
+    # Endpoints are the extremes of the block projected on its principal axis. Blocks
+    # always use four-colour mode (color0 > color1), which BC3 requires as well
+    colors = blocks[..., :3].astype(np.float32)
+    mean = colors.mean(axis=1, keepdims=True)
+    centered = colors - mean
+    covariance = np.einsum('bki,bkj->bij', centered, centered)
+    axis = np.ones((len(blocks), 3), dtype=np.float32)
+    for _ in range(8):
+        axis = np.einsum('bij,bj->bi', covariance, axis)
+        axis /= np.maximum(np.abs(axis).max(axis=1, keepdims=True), 1e-12)
+    axis /= np.maximum(np.linalg.norm(axis, axis=1, keepdims=True), 1e-12)
+    projection = np.einsum('bki,bi->bk', centered, axis)
+    endpoint_a = mean[:, 0] + projection.max(axis=1)[:, None] * axis
+    endpoint_b = mean[:, 0] + projection.min(axis=1)[:, None] * axis
+
+    color0 = pack_565(endpoint_a)
+    color1 = pack_565(endpoint_b)
+    swap = color0 < color1
+    color0, color1 = np.where(swap, color1, color0), np.where(swap, color0, color1)
+
+    decoded0 = unpack_565(color0)
+    decoded1 = unpack_565(color1)
+    palette = np.stack([
+        decoded0,
+        decoded1,
+        (2 * decoded0 + decoded1) / 3,
+        (decoded0 + 2 * decoded1) / 3,
+    ], axis=1)
+    distances = ((colors[:, :, None, :] - palette[:, None, :, :]) ** 2).sum(axis=-1)
+    indices = distances.argmin(axis=2).astype(np.uint32)
+    # Flat blocks have a single endpoint; index 0 keeps them exact
+    indices[color0 == color1] = 0
+    selectors = (indices << (2 * np.arange(16, dtype=np.uint32))).sum(axis=1, dtype=np.uint32)
+
+    encoded = np.empty((len(blocks), 8), dtype=np.uint8)
+    encoded[:, 0:2] = color0.astype('<u2').view(np.uint8).reshape(-1, 2)
+    encoded[:, 2:4] = color1.astype('<u2').view(np.uint8).reshape(-1, 2)
+    encoded[:, 4:8] = selectors.astype('<u4').view(np.uint8).reshape(-1, 4)
+    return encoded
+
+def encode_alpha_blocks(blocks):
+    # Eight-value mode: alpha0 is the block maximum, alpha1 the minimum
+    alpha = blocks[..., 3].astype(np.int32)
+    alpha0 = alpha.max(axis=1)
+    alpha1 = alpha.min(axis=1)
+    steps = np.arange(8, dtype=np.int32)
+    # Palette order 0, 7, 1..6 runs alpha0 -> alpha1 in eight even steps
+    ramp = (alpha0[:, None] * (7 - steps) + alpha1[:, None] * steps) / 7.0
+    ramp_to_index = np.array([0, 2, 3, 4, 5, 6, 7, 1], dtype=np.uint64)
+    nearest = np.abs(alpha[:, :, None] - ramp[:, None, :]).argmin(axis=2)
+    indices = ramp_to_index[nearest]
+    indices[alpha0 == alpha1] = 0
+    selectors = (indices << (3 * np.arange(16, dtype=np.uint64))).sum(axis=1, dtype=np.uint64)
+
+    encoded = np.empty((len(blocks), 8), dtype=np.uint8)
+    encoded[:, 0] = alpha0
+    encoded[:, 1] = alpha1
+    encoded[:, 2:8] = selectors.astype('<u8').view(np.uint8).reshape(-1, 8)[:, :6]
+    return encoded
+
+def encode_level(level, texture_format):
+    if texture_format == 'RGBA8':
+        # B, G, R, A byte order to match the masks in the header
+        return np.ascontiguousarray(level[..., [2, 1, 0, 3]]).tobytes()
+    blocks = texel_blocks(level)
+    if texture_format == 'BC1':
+        return encode_color_blocks(blocks).tobytes()
+    return np.concatenate([encode_alpha_blocks(blocks), encode_color_blocks(blocks)], axis=1).tobytes()
+
+def dds_header(width, height, mip_count, texture_format):
+    flags = DDSD_CAPS | DDSD_HEIGHT | DDSD_WIDTH | DDSD_PIXELFORMAT | DDSD_MIPMAPCOUNT
+    caps = DDSCAPS_TEXTURE
+    if mip_count > 1:
+        caps |= DDSCAPS_COMPLEX | DDSCAPS_MIPMAP
+    if texture_format == 'RGBA8':
+        flags |= DDSD_PITCH
+        pitch = width * 4
+        pixel_format = (32, DDPF_RGB | DDPF_ALPHAPIXELS, b'\0\0\0\0', 32, 0x00FF0000, 0x0000FF00, 0x000000FF, 0xFF000000)
+    else:
+        flags |= DDSD_LINEARSIZE
+        pitch = max(1, (width + 3) // 4) * max(1, (height + 3) // 4) * BLOCK_BYTES[texture_format]
+        pixel_format = (32, DDPF_FOURCC, FOURCC[texture_format], 0, 0, 0, 0, 0)
+    return DDS_HEADER_STRUCT.pack(
+        DDS_MAGIC, 124, flags, height, width, pitch, 0, mip_count,
+        *pixel_format,
+        caps, 0, 0, 0, 0,
+    )
+
+def encode_texture(pixels, texture_format):
+    # pixels: (height, width, 4) uint8 RGBA, top row first
+    pixels = np.ascontiguousarray(pixels, dtype=np.uint8)
+    if texture_format not in TEXTURE_FORMATS:
+        raise ValueError(f"Unknown texture format '{texture_format}', expected one of {', '.join(TEXTURE_FORMATS)}")
+    levels = mip_chain(pixels)
+    height, width = pixels.shape[:2]
+    parts = [dds_header(width, height, len(levels), texture_format)]
+    parts.extend(encode_level(level, texture_format) for level in levels)
+    return b''.join(parts)
+
+def encode_texture_file(pixels, texture_format, output_path):
+    # Process pool entry point. The file is replaced atomically, so an interrupted
+    # export never leaves a half-written texture behind
+    data = encode_texture(pixels, texture_format)
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    temp_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, output_path)
+    return len(data)
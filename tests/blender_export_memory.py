@@ -0,0 +1,105 @@
+# Repeated-export check for leaked meshes and memory. Needs Blender:
+#
+#   blender --background --factory-startup --python tests/blender_export_memory.py -- --runs 20
+#
+# Builds a few objects that use a node group from the bundled asset file, some of
+# them with Subdivision and Decimate modifiers so the exporter evaluates a temporary
+# mesh, then exports them --runs times. Fails if bpy.data.meshes changes size between
+# exports or if the process grows by more than --max-rss-growth MB after the warm-up
+# exports.
+import argparse
+import os
+import sys
+import tempfile
+
+import bpy
+
+addon_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'io_export_rbm')
+if addon_dir not in sys.path:
+    sys.path.append(addon_dir)
+
+import export_rbm_script
+from rbm_assets import AssetIndex
+
+WARMUP_RUNS = 3
+
+def resident_bytes():
+    # Current resident set size, or None where it can't be read without extra packages
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def build_scene(object_count):
+    node_group, _ = AssetIndex(addon_dir).node_group('CARPAINTMM')
+    material = bpy.data.materials.new(name="RBMLeakCheck")
+    material.use_nodes = True
+    material.node_tree.nodes.new("ShaderNodeGroup").node_tree = node_group
+
+    objects = []
+    for i in range(object_count):
+        bpy.ops.mesh.primitive_uv_sphere_add(segments=64, ring_count=32, location=(i * 3.0, 0.0, 0.0))
+        obj = bpy.context.active_object
+        obj.data.materials.append(material)
+        if i % 2:
+            obj.modifiers.new("Subdivision", 'SUBSURF').levels = 1
+        if i % 3 == 2:
+            # Decimate's delimit is an enum-flag (set) property, part of the instance key
+            obj.modifiers.new("Decimate", 'DECIMATE').ratio = 0.5
+        objects.append(obj)
+    return objects
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="blender_export_memory.py")
+    parser.add_argument('--runs', type=int, default=20, help="Exports to run after the warm-up")
+    parser.add_argument('--objects', type=int, default=6, help="Objects in the exported scene")
+    parser.add_argument('--max-rss-growth', type=float, default=32.0, help="Allowed growth in MB over all runs")
+    args = parser.parse_args(argv)
+
+    objects = build_scene(args.objects)
+    supported_nodegroups = list(export_rbm_script.MATERIAL_SCHEMAS)
+    failures = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output_path = os.path.join(temp_dir, "leak_check.rbm")
+
+        def export():
+            written = export_rbm_script.export_streaming(output_path, objects, supported_nodegroups)
+            if written is None:
+                raise RuntimeError("Nothing was exported")
+
+        for _ in range(WARMUP_RUNS):
+            export()
+        mesh_count = len(bpy.data.meshes)
+        start_rss = resident_bytes()
+
+        for run in range(args.runs):
+            export()
+            if len(bpy.data.meshes) != mesh_count:
+                failures.append(f"run {run}: bpy.data.meshes went from {mesh_count} to {len(bpy.data.meshes)}")
+                mesh_count = len(bpy.data.meshes)
+
+        end_rss = resident_bytes()
+
+    if start_rss is None or end_rss is None:
+        print("RSS is not available on this platform; only bpy.data.meshes was checked")
+    else:
+        growth = (end_rss - start_rss) / 1e6
+        print(f"RSS {start_rss / 1e6:.1f} MB -> {end_rss / 1e6:.1f} MB over {args.runs} exports ({growth:+.1f} MB)")
+        if growth > args.max_rss_growth:
+            failures.append(f"RSS grew by {growth:.1f} MB, more than {args.max_rss_growth:.1f} MB")
+
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if not failures:
+        print(f"OK: {args.runs} exports, {len(bpy.data.meshes)} meshes in bpy.data.meshes")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    sys.exit(main(argv))
@@ -0,0 +1,52 @@
+# compress_normals must produce exactly the bytes the per-vector compress_normal
+# path wrote: struct.pack('<f', math.copysign(compress_normal(v), sign)).
+import math
+import os
+import struct
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'io_export_rbm'))
+
+from rbm_format import compress_normal, compress_normals
+
+Vector = namedtuple('Vector', 'x y z')
+
+EDGE_VALUES = (-1.0, -0.0, 0.0, 1.0)
+
+def reference_bits(vectors, signs):
+    packed = b''.join(struct.pack('<f', math.copysign(compress_normal(Vector(*map(float, vector))), float(sign)))
+                      for vector, sign in zip(vectors, signs))
+    return np.frombuffer(packed, dtype='<u4')
+
+def assert_bit_identical(vectors, signs):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    signs = np.asarray(signs, dtype=np.float32)
+    expected = reference_bits(vectors, signs)
+    actual = compress_normals(vectors, signs).astype('<f4').view('<u4')
+    np.testing.assert_array_equal(actual, expected)
+
+def test_random_unit_vectors():
+    rng = np.random.default_rng(2024)
+    vectors = rng.normal(size=(20000, 3)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    signs = np.where(rng.random(len(vectors)) < 0.5, -1.0, 1.0)
+    assert_bit_identical(vectors, signs)
+
+def test_random_components_in_range():
+    # Tangent-space values are not always normalised; cover the whole [-1, 1] cube
+    rng = np.random.default_rng(7)
+    vectors = rng.uniform(-1.0, 1.0, size=(20000, 3)).astype(np.float32)
+    assert_bit_identical(vectors, np.ones(len(vectors)))
+
+def test_edge_values():
+    vectors = [(x, y, z) for x in EDGE_VALUES for y in EDGE_VALUES for z in EDGE_VALUES]
+    for sign in (1.0, -1.0, 0.0, -0.0):
+        assert_bit_identical(vectors, [sign] * len(vectors))
+
+def test_without_signs():
+    vectors = np.array([(x, y, z) for x in EDGE_VALUES for y in EDGE_VALUES for z in EDGE_VALUES], dtype=np.float32)
+    expected = reference_bits(vectors, np.ones(len(vectors)))
+    np.testing.assert_array_equal(compress_normals(vectors).astype('<f4').view('<u4'), expected)
@@ -0,0 +1,82 @@
+# instance_key must give a hashable key for every modifier stack it accepts, since
+# InstanceCache.claim looks the key up in a dict. The objects here stand in for bpy
+# objects: only the attributes instance_key reads are provided.
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'io_export_rbm'))
+
+from rbm_cache import InstanceCache, instance_key
+
+class Mesh:
+    def as_pointer(self):
+        return id(self)
+
+def prop(identifier, prop_type, is_array=False):
+    return SimpleNamespace(identifier=identifier, type=prop_type, is_array=is_array)
+
+def decimate(ratio=0.5, delimit=frozenset({'NORMAL'})):
+    # Decimate's delimit is an enum-flag property: bpy returns it as a set
+    return SimpleNamespace(
+        type='DECIMATE',
+        bl_rna=SimpleNamespace(properties=[
+            prop('rna_type', 'POINTER'),
+            prop('name', 'STRING'),
+            prop('ratio', 'FLOAT'),
+            prop('delimit', 'ENUM'),
+            prop('symmetry_axis', 'ENUM'),
+            prop('vertex_group', 'STRING'),
+        ]),
+        rna_type=None,
+        name="Decimate",
+        ratio=ratio,
+        delimit=set(delimit),
+        symmetry_axis='X',
+        vertex_group="",
+    )
+
+def mesh_object(mesh, *modifiers):
+    return SimpleNamespace(data=mesh, modifiers=list(modifiers), show_only_shape_key=False, active_shape_key_index=0)
+
+def test_enum_flag_property_is_hashable():
+    mesh = Mesh()
+    key = instance_key(mesh_object(mesh, decimate(delimit={'SEAM', 'NORMAL'})))
+    assert key is not None
+    cache = InstanceCache()
+    assert cache.claim(key, "first")
+    assert not cache.claim(instance_key(mesh_object(mesh, decimate(delimit={'NORMAL', 'SEAM'}))), "second")
+
+def test_different_modifier_values_give_different_keys():
+    mesh = Mesh()
+    base = instance_key(mesh_object(mesh, decimate()))
+    assert instance_key(mesh_object(mesh, decimate(delimit={'UV'}))) != base
+    assert instance_key(mesh_object(mesh, decimate(ratio=0.25))) != base
+    assert instance_key(mesh_object(Mesh(), decimate())) != base
+
+def test_array_property_is_hashable():
+    mirror = SimpleNamespace(
+        type='MIRROR',
+        bl_rna=SimpleNamespace(properties=[prop('use_axis', 'BOOLEAN', is_array=True)]),
+        use_axis=[True, False, False],
+    )
+    key = instance_key(mesh_object(Mesh(), mirror))
+    assert key is not None
+    hash(key)
+
+def test_unhashable_value_disables_sharing():
+    modifier = SimpleNamespace(
+        type='CUSTOM',
+        bl_rna=SimpleNamespace(properties=[prop('settings', 'FLOAT')]),
+        settings={'a': 1},
+    )
+    assert instance_key(mesh_object(Mesh(), modifier)) is None
+
+def test_object_reference_or_geometry_nodes_disable_sharing():
+    mirror = SimpleNamespace(
+        type='MIRROR',
+        bl_rna=SimpleNamespace(properties=[prop('mirror_object', 'POINTER')]),
+        mirror_object=object(),
+    )
+    assert instance_key(mesh_object(Mesh(), mirror)) is None
+    assert instance_key(mesh_object(Mesh(), SimpleNamespace(type='NODES'))) is None